@@ -0,0 +1,49 @@
+"""
+Run the whole benchmark suite offline:
+
+    python -m benchmarks [--quick]
+"""
+import argparse
+
+from benchmarks import dispatcher_throughput, events_outbox, line_model, scrape
+from benchmarks.datasets import Dataset
+from benchmarks.fake_services import FakeServices
+from bot.metrics import metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='smaller datasets, for a smoke run')
+    args = parser.parse_args()
+
+    n_lines, n_updates, workers = (30, 30, (1, 4)) if args.quick else (300, 300, (1, 2, 4, 8, 16))
+    dataset = Dataset(n_lines=n_lines)
+
+    print('# Scraper')
+    for name, elapsed, round_trips, requests in scrape.run(dataset, firestore_latency=0.02, service_latency=0.01):
+        print(f'scrape {name:10s} {elapsed:8.2f}s firestore={round_trips:5d} http={requests:5d}')
+
+    print('\n# Dispatcher')
+    with FakeServices(dataset, latency=0.1) as services:
+        for w in workers:
+            throughput = dispatcher_throughput.run(w, n_updates, api_latency=0.02, firestore_latency=0.02,
+                                                   services=services)
+            print(f'workers={w:3d} throughput={throughput:8.1f} updates/s')
+
+    print('\n# Handlers')
+    print(metrics.summary())
+
+    print('\n# Line model')
+    for cls in (line_model.LegacyLine, line_model.Line):
+        memory, load, dump = line_model.measure(cls, n_lines * 30, 200)
+        print(f'{cls.__name__:10s} memory={memory / 2 ** 20:8.1f}MiB '
+              f'from_dict={n_lines * 30 / load:10.0f} lines/s to_dict={n_lines * 30 / dump:10.0f} lines/s')
+
+    print('\n# Events and outbox')
+    for name, publish, read, fan_out, drain, round_trips in events_outbox.run(n_lines * 10, n_lines * 50):
+        print(f'{name:10s} publish={publish:8.0f} events/s read={read:8.0f} events/s '
+              f'fan_out={fan_out:8.0f} msg/s drain={drain:8.0f} msg/s firestore={round_trips:6d}')
+
+
+if __name__ == '__main__':
+    main()
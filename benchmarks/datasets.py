@@ -0,0 +1,49 @@
+"""
+Synthetic datasets shaped like the GrandaBus timetable page.
+"""
+import random
+
+
+class Dataset:
+    """
+    A set of lines, each serving a few cities, with a fake timetable pdf.
+
+    :param n_lines: number of lines
+    :param n_cities: number of distinct cities
+    :param cities_per_line: number of cities served by every line
+    :param pdf_size: size in bytes of every timetable
+    :param seed: seed of the random generator
+    """
+
+    def __init__(self, n_lines=300, n_cities=250, cities_per_line=8, pdf_size=200 * 1024, seed=0):
+        rnd = random.Random(seed)
+        self.cities = [f'CITTA {i}' for i in range(n_cities)]
+        self.lines = [{
+            'code': f'{i:03d}',
+            'name': f'Linea {i}',
+            'cities': rnd.sample(self.cities, min(cities_per_line, n_cities)),
+        } for i in range(n_lines)]
+        self.pdf_size = pdf_size
+        # bumping the version of a line changes the content of its timetable
+        self.versions = {line['code']: 0 for line in self.lines}
+
+    def timetable(self, code):
+        """
+        :param code: code of the line
+        :return: deterministic pdf-like payload of the line timetable
+        """
+        rnd = random.Random(f'{code}-{self.versions[code]}')
+        return b'%PDF-1.4\n' + rnd.getrandbits(8 * self.pdf_size).to_bytes(self.pdf_size, 'little')
+
+    def html(self, base_url):
+        """
+        :param base_url: url prefix of the timetables
+        :return: the timetable page, one row for each (city, line) pair
+        """
+        rows = ''.join(
+            f'<tr><td>CN</td><td>{city}</td><td>{line["code"]}</td><td>{line["name"]}</td>'
+            f'<td><a href="{base_url}/timetables/{line["code"]}.pdf">PDF</a></td></tr>'
+            for line in self.lines for city in line['cities'])
+        return ('<html><body><table id="tablepress-99"><thead><tr>'
+                '<th>Provincia</th><th>Comune</th><th>Codice</th><th>Linea</th><th>URL</th>'
+                f'</tr></thead><tbody>{rows}</tbody></table></body></html>')
@@ -0,0 +1,170 @@
+"""
+Measure how the bot throughput scales with the number of dispatcher workers.
+
+Updates are fed straight into a Dispatcher running the real handlers, backed by
+a fake Telegram API, a fake Firestore and a local LocationIQ stand-in, all with
+a configurable latency.
+
+    python -m benchmarks.dispatcher_throughput --updates 200 --workers 1 2 4 8
+"""
+import argparse
+import os
+import threading
+import time
+from queue import Queue
+
+os.environ.setdefault('LOCATIONIQ_API_KEY', 'benchmark')
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Dispatcher, JobQueue  # noqa: E402
+
+import bot.handlers.location as location  # noqa: E402
+from benchmarks.datasets import Dataset  # noqa: E402
+from benchmarks.fake_services import FakeServices  # noqa: E402
+from benchmarks.fakes import FakeFirestore, FakeTelegramBot  # noqa: E402
+from bot.decorators import set_firestore_client  # noqa: E402
+from bot.handlers import register_all_handlers  # noqa: E402
+from bot.metrics import metrics  # noqa: E402
+from bot.rendering import responses  # noqa: E402
+from line import normalize_city  # noqa: E402
+
+# Telegram API calls generated by each kind of update, see make_updates
+CALLS_PER_KIND = (
+    2,  # location: reply, menu hint
+    2,  # notifications toggle: keyboard edit, callback answer
+    2,  # /disclaimer: chat action, reply
+    2,  # /start: chat action, reply
+    1,  # search by city conversation entry: prompt
+)
+
+
+class _DispatcherAdapter:
+    """
+    Expose the GrandaBusBot handler registration interface on top of a bare dispatcher.
+    """
+
+    def __init__(self, dispatcher):
+        self.add_handler = dispatcher.add_handler
+        self.add_error_handler = dispatcher.add_error_handler
+
+
+def _user(i):
+    return {'id': i, 'is_bot': False, 'first_name': f'user{i}'}
+
+
+def _message(i, **payload):
+    return dict(message_id=i, date=int(time.time()), chat={'id': i, 'type': 'private'}, **{'from': _user(i)},
+                **payload)
+
+
+def _command(i, command):
+    return _message(i, text=command, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+
+def make_updates(n):
+    """
+    Build a mix of location messages, notification toggles, /disclaimer and
+    /start commands and entries of the search by city conversation.
+    :param n: number of updates
+    :return: list of json updates
+    """
+    updates = list()
+    for i in range(1, n + 1):
+        kind = i % len(CALLS_PER_KIND)
+        if kind == 0:
+            update = {'message': _message(i, location={'latitude': 44 + i / 1000, 'longitude': 7.55})}
+        elif kind == 1:
+            update = {'callback_query': {'id': str(i), 'from': _user(i), 'chat_instance': str(i),
+                                         'data': f'enable_notif_{i % 10:03d}',
+                                         'message': _message(i, text='linea')}}
+        elif kind == 2:
+            update = {'message': _command(i, '/disclaimer')}
+        elif kind == 3:
+            update = {'message': _command(i, '/start')}
+        else:
+            update = {'message': _message(i, text='🏙️ Cerca per località')}
+        updates.append(dict(update_id=i, **update))
+    return updates
+
+
+def expected_calls(n):
+    """
+    :param n: number of updates built by make_updates
+    :return: Telegram API calls generated by the updates
+    """
+    return sum(CALLS_PER_KIND[i % len(CALLS_PER_KIND)] for i in range(1, n + 1))
+
+
+def seed(firestore, dataset: Dataset):
+    lines = firestore.collection('lines')
+    cities = dict()
+    for line in dataset.lines:
+        entry = {'code': line['code'], 'name': line['name'],
+                 'timetable_url': f'https://example.org/{line["code"]}.pdf'}
+        lines.document(line['code']).set(dict(entry, cities=line['cities'], file_hash=None, user_subscriptions=[]))
+        for city in line['cities']:
+            cities.setdefault(normalize_city(city), list()).append(entry)
+
+    for city, city_lines in cities.items():
+        firestore.collection('cities').document(city).set({'lines': city_lines})
+
+
+def run(workers, n_updates, api_latency, firestore_latency, services: FakeServices):
+    """
+    :return: processed updates per second
+    """
+    telegram = FakeTelegramBot(api_latency)
+    firestore = FakeFirestore(firestore_latency)
+    seed(firestore, services.dataset)
+    set_firestore_client(firestore)
+    # start every run with cold caches
+    responses.reload([])
+    location.LOCATIONIQ_ENDPOINT = services.url('/v1/reverse.php')
+
+    # the job queue runs the slow-reply fallbacks, as in the bot
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(telegram, Queue(), workers=workers, job_queue=job_queue, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    job_queue.start()
+    # the first Dispatcher of the process keeps the singleton used by run_async
+    Dispatcher._set_singleton(dispatcher)
+    register_all_handlers(_DispatcherAdapter(dispatcher))
+
+    updates = [Update.de_json(u, telegram) for u in make_updates(n_updates)]
+    thread = threading.Thread(target=dispatcher.start, daemon=True)
+    thread.start()
+
+    start = time.perf_counter()
+    for update in updates:
+        dispatcher.update_queue.put(update)
+    completed = telegram.wait_for_calls(expected_calls(n_updates), timeout=600)
+    elapsed = time.perf_counter() - start
+
+    dispatcher.stop()
+    thread.join()
+    job_queue.stop()
+
+    if not completed:
+        raise RuntimeError('Not all the updates were processed')
+    return n_updates / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--api-latency', type=float, default=0.02, help='seconds per Telegram API call')
+    parser.add_argument('--firestore-latency', type=float, default=0.02, help='seconds per Firestore round trip')
+    parser.add_argument('--geocode-latency', type=float, default=0.1, help='seconds per LocationIQ call')
+    args = parser.parse_args()
+
+    with FakeServices(Dataset(), args.geocode_latency) as services:
+        for workers in args.workers:
+            throughput = run(workers, args.updates, args.api_latency, args.firestore_latency, services)
+            print(f'workers={workers:3d} throughput={throughput:8.1f} updates/s')
+
+    print(metrics.summary())
+
+
+if __name__ == '__main__':
+    main()
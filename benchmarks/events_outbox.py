@@ -0,0 +1,116 @@
+"""
+Measure the event queue and the notifications outbox on the Firestore
+stand-in and on SQLite.
+
+    python -m benchmarks.events_outbox --events 500 --messages 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import FakeFirestore
+from bot.outbox import FirestoreOutbox, OutboxMessage, SqliteOutbox
+from events import FirestoreEventQueue, SqliteEventQueue, LINES_SAVED
+from events.base import Event, event_id
+
+# events published in the same instant, as the ones of a scraper session
+EVENTS_PER_TIMESTAMP = 10
+# notifications of each event
+MESSAGES_PER_EVENT = 100
+
+
+def run_events(queue, n_events, limit=50):
+    """
+    Publish events, several per timestamp, and read them back page by page.
+    :return: seconds spent publishing, seconds spent reading
+    """
+    since = time.time() - 1
+    start = time.perf_counter()
+    for i in range(0, n_events, EVENTS_PER_TIMESTAMP):
+        created = time.time()
+        for n in range(i, min(i + EVENTS_PER_TIMESTAMP, n_events)):
+            payload = {u'n': n}
+            queue._append(Event(event_id(LINES_SAVED, payload), LINES_SAVED, payload, created))
+    publish = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cursor = queue.cursor_since(since)
+    read = 0
+    while True:
+        events, cursor = queue.read(cursor, limit)
+        if not events:
+            break
+        read += len(events)
+    elapsed = time.perf_counter() - start
+
+    if read != n_events:
+        raise RuntimeError(f'Read {read} events out of {n_events}')
+    return publish, elapsed
+
+
+def run_outbox(outbox, n_messages, batch_size=100):
+    """
+    Fan out the messages of a few events (twice, as two workers would) and
+    drain the outbox.
+    :return: seconds spent fanning out, seconds spent draining
+    """
+    start = time.perf_counter()
+    for i in range(0, n_messages, MESSAGES_PER_EVENT):
+        messages = [OutboxMessage(f'e{i}:{chat}:0', chat, 'message', {'text': 'x'})
+                    for chat in range(i, min(i + MESSAGES_PER_EVENT, n_messages))]
+        for worker in range(2):
+            outbox.fan_out(f'e{i}', messages)
+    fan_out = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        messages = outbox.dequeue(batch_size)
+        if not messages:
+            break
+        outbox.ack([m.key for m in messages])
+        sent += len(messages)
+    drain = time.perf_counter() - start
+
+    if sent != n_messages:
+        raise RuntimeError(f'Delivered {sent} messages out of {n_messages}')
+    return fan_out, drain
+
+
+def run(n_events, n_messages, firestore_latency=0.0):
+    """
+    :return: list of (backend, events published/s, events read/s, messages fanned out/s, messages drained/s,
+             Firestore round trips)
+    """
+    results = list()
+    with tempfile.TemporaryDirectory() as directory:
+        firestore = FakeFirestore(firestore_latency)
+        backends = (
+            ('firestore', FirestoreEventQueue(firestore), FirestoreOutbox(firestore)),
+            ('sqlite', SqliteEventQueue(os.path.join(directory, 'events.db')),
+             SqliteOutbox(os.path.join(directory, 'outbox.db'))),
+        )
+        for name, queue, outbox in backends:
+            round_trips = firestore.round_trips
+            publish, read = run_events(queue, n_events)
+            fan_out, drain = run_outbox(outbox, n_messages)
+            results.append((name, n_events / publish, n_events / read, n_messages / fan_out, n_messages / drain,
+                            firestore.round_trips - round_trips))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--firestore-latency', type=float, default=0.0, help='seconds per Firestore round trip')
+    args = parser.parse_args()
+
+    for name, publish, read, fan_out, drain, round_trips in run(args.events, args.messages, args.firestore_latency):
+        print(f'{name:10s} publish={publish:8.0f} events/s read={read:8.0f} events/s '
+              f'fan_out={fan_out:8.0f} msg/s drain={drain:8.0f} msg/s firestore={round_trips:6d}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Local HTTP stand-ins for grandabus.it, Bit.ly and LocationIQ, served by aiohttp
+on a background thread so that both sync and async clients can reach them.
+"""
+import asyncio
+import threading
+
+from aiohttp import web
+
+from benchmarks.datasets import Dataset
+
+
+class FakeServices:
+    """
+    :param dataset: lines published by the fake grandabus.it
+    :param latency: seconds spent serving every request
+    """
+
+    def __init__(self, dataset: Dataset, latency=0.0):
+        self.dataset = dataset
+        self.latency = latency
+        self.requests = 0
+        self.base_url = None
+        self._links = dict()
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._thread = None
+
+    def url(self, path):
+        return f'{self.base_url}{path}'
+
+    def start(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def _serve(self, started):
+        asyncio.set_event_loop(self._loop)
+
+        app = web.Application(middlewares=[self._latency_middleware])
+        app.router.add_get('/orari-per-localita/', self._timetable_page)
+        app.router.add_get('/timetables/{code}.pdf', self._timetable)
+        app.router.add_post('/v4/shorten', self._shorten)
+        app.router.add_get('/s/{key}', self._follow)
+        app.router.add_get('/v1/reverse.php', self._reverse_geocode)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        self._loop.run_until_complete(site.start())
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        started.set()
+        self._loop.run_forever()
+
+    @web.middleware
+    async def _latency_middleware(self, request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def _timetable_page(self, _):
+        return web.Response(text=self.dataset.html(self.base_url), content_type='text/html')
+
+    async def _timetable(self, request):
+        code = request.match_info['code']
+        if code not in self.dataset.versions:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.dataset.timetable(code), content_type='application/pdf')
+
+    async def _shorten(self, request):
+        payload = await request.json()
+        key = f'{len(self._links):x}'
+        self._links[key] = payload['long_url']
+        return web.json_response({'link': self.url(f'/s/{key}')}, status=201)
+
+    async def _follow(self, request):
+        url = self._links.get(request.match_info['key'])
+        if url is None:
+            raise web.HTTPNotFound()
+        raise web.HTTPFound(url)
+
+    async def _reverse_geocode(self, request):
+        # deterministic city for every coordinate
+        lat = float(request.query['lat'])
+        city = self.dataset.cities[int(lat * 1000) % len(self.dataset.cities)]
+        return web.json_response({'address': {'city': city.title()}})
@@ -0,0 +1,332 @@
+"""
+Local stand-ins for the services the bot talks to, used by the benchmarks.
+"""
+import copy
+import itertools
+import threading
+import time
+
+from google.api_core.exceptions import Conflict, FailedPrecondition, InvalidArgument, NotFound
+
+
+class ArrayUnion:
+    """
+    Stand-in of the Firestore ArrayUnion transform.
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    """
+    Stand-in of the Firestore ArrayRemove transform.
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.update_time = update_time
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return FakeCollection(self._db, self._path + (name,))
+
+    def get(self):
+        self._db.io()
+        data, update_time = self._db.read(self._path)
+        return FakeSnapshot(self, data, update_time)
+
+    def set(self, data, merge=False):
+        self._db.io()
+        self._db.write(self._path, data, merge)
+
+    def update(self, data, option=None):
+        self._db.io()
+        with self._db.lock:
+            self._db.check_update(self._path, option)
+            self._db.write(self._path, data, merge=True)
+
+    def create(self, data):
+        self._db.io()
+        with self._db.lock:
+            self._db.check_create(self._path)
+            self._db.write(self._path, data, merge=False)
+
+    def delete(self):
+        self._db.io()
+        self._db.remove(self._path)
+
+
+# field path of the document id
+DOCUMENT_ID = '__name__'
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    'array_contains': lambda a, b: b in a,
+}
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), cursor=None, limit=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._cursor = cursor
+        self._limit = limit
+
+    def _copy(self, **changes):
+        fields = dict(filters=self._filters, orders=self._orders, cursor=self._cursor, limit=self._limit)
+        fields.update(changes)
+        return FakeQuery(self._collection, **fields)
+
+    def where(self, field, op, value):
+        if op not in _OPERATORS:
+            raise NotImplementedError(f'Unsupported operator {op}')
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field, direction == 'DESCENDING'),))
+
+    def start_after(self, values):
+        return self._copy(cursor=list(values))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, _):
+        # projections only save bandwidth, documents are returned whole
+        return self
+
+    @staticmethod
+    def _value(doc_id, data, field):
+        return doc_id if field == DOCUMENT_ID else data.get(field)
+
+    def _matches(self, doc_id, data):
+        for field, op, value in self._filters:
+            current = self._value(doc_id, data, field)
+            # as in Firestore, documents missing the field never match
+            if current is None or not _OPERATORS[op](current, value):
+                return False
+        # and documents missing an ordering field are not returned
+        return all(self._value(doc_id, data, field) is not None for field, _ in self._orders)
+
+    def _after_cursor(self, doc_id, data):
+        for (field, descending), value in zip(self._orders, self._cursor):
+            current = self._value(doc_id, data, field)
+            if current != value:
+                return current < value if descending else current > value
+        return False
+
+    def stream(self):
+        db = self._collection.db
+        db.io()
+        docs = [(doc_id, data, update_time) for doc_id, data, update_time in db.list(self._collection.path)
+                if self._matches(doc_id, data)]
+        # stable sorts, from the last ordering to the first
+        for field, descending in reversed(self._orders):
+            docs.sort(key=lambda doc: self._value(doc[0], doc[1], field), reverse=descending)
+        if self._cursor is not None:
+            docs = [doc for doc in docs if self._after_cursor(doc[0], doc[1])]
+        return iter([FakeSnapshot(self._collection.document(doc_id), data, update_time)
+                     for doc_id, data, update_time in docs[:self._limit]])
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        super().__init__(self)
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.path + (doc_id,))
+
+
+class FakeBatch:
+    """
+    Atomic batch: preconditions of every write are checked before any write is applied.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._checks = list()
+        self._ops = list()
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda: self._db.write(ref._path, data, merge))
+
+    def create(self, ref, data):
+        self._checks.append(lambda: self._db.check_create(ref._path))
+        self._ops.append(lambda: self._db.write(ref._path, data, merge=False))
+
+    def update(self, ref, data):
+        self._checks.append(lambda: self._db.check_update(ref._path))
+        self._ops.append(lambda: self._db.write(ref._path, data, merge=True))
+
+    def delete(self, ref):
+        self._ops.append(lambda: self._db.remove(ref._path))
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise InvalidArgument('Firestore batches are limited to 500 writes')
+        self._db.io()
+        with self._db.lock:
+            for check in self._checks:
+                check()
+            for op in self._ops:
+                op()
+        self._checks, self._ops = list(), list()
+
+
+class FakeFirestore:
+    """
+    In-memory Firestore client supporting the subset of the API used by the bot
+    and the scraper: collections, documents, atomic batches, queries with
+    `where` (`==`, comparisons, `array_contains`), `order_by`, `start_after`
+    and `limit`, create and update preconditions raising the exceptions of
+    google.api_core, ArrayUnion/ArrayRemove transforms.
+
+    :param latency: seconds spent on every round trip
+    """
+
+    # transforms of the stand-in, used instead of the ones of firebase_admin
+    ArrayUnion = ArrayUnion
+    ArrayRemove = ArrayRemove
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.round_trips = 0
+        # path -> (data, update time)
+        self._docs = dict()
+        self._clock = itertools.count(1)
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def batch(self):
+        return FakeBatch(self)
+
+    @staticmethod
+    def write_option(last_update_time):
+        return FakeWriteOption(last_update_time)
+
+    def io(self):
+        with self.lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def read(self, path):
+        """
+        :return: tuple (copy of the data or None, update time)
+        """
+        with self.lock:
+            data, update_time = self._docs.get(path, (None, None))
+            return copy.deepcopy(data), update_time
+
+    def list(self, collection_path):
+        with self.lock:
+            return [(path[-1], copy.deepcopy(data), update_time) for path, (data, update_time) in self._docs.items()
+                    if path[:-1] == collection_path]
+
+    def check_create(self, path):
+        with self.lock:
+            if path in self._docs:
+                raise Conflict(f'Document already exists: {"/".join(path)}')
+
+    def check_update(self, path, option=None):
+        with self.lock:
+            if path not in self._docs:
+                raise NotFound(f'No document to update: {"/".join(path)}')
+            if option is not None and self._docs[path][1] != option.last_update_time:
+                raise FailedPrecondition(f'Document changed since {option.last_update_time}: {"/".join(path)}')
+
+    def write(self, path, data, merge):
+        with self.lock:
+            current = self._docs.get(path, (None, None))[0] if merge else None
+            current = dict(current) if current else dict()
+            for key, value in data.items():
+                current[key] = self._apply(current.get(key), value)
+            self._docs[path] = (current, next(self._clock))
+
+    def remove(self, path):
+        with self.lock:
+            self._docs.pop(path, None)
+
+    @staticmethod
+    def _apply(old, value):
+        # duck-typed transforms: the stand-in ones or the google.cloud.firestore ones
+        kind = type(value).__name__
+        if kind == 'ArrayUnion':
+            old = list(old or ())
+            return old + [v for v in value.values if v not in old]
+        if kind == 'ArrayRemove':
+            return [v for v in (old or ()) if v not in value.values]
+        return copy.deepcopy(value)
+
+
+class FakeTelegramBot:
+    """
+    Stand-in for telegram.Bot: every API method sleeps for `latency` seconds
+    and counts the call.
+    """
+
+    # read by the Dispatcher to name its threads
+    id = 1
+    username = 'benchmark_bot'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._cv = threading.Condition()
+
+    def _call(self, *_, **__):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._cv:
+            self.calls += 1
+            self._cv.notify_all()
+
+    send_message = _call
+    send_document = _call
+    send_chat_action = _call
+    answer_callback_query = _call
+    edit_message_text = _call
+    edit_message_reply_markup = _call
+
+    def wait_for_calls(self, n, timeout=None):
+        """
+        Block until at least n API calls have been made.
+        :return: true if the calls were made before the timeout
+        """
+        with self._cv:
+            return self._cv.wait_for(lambda: self.calls >= n, timeout)
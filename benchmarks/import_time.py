@@ -0,0 +1,55 @@
+"""
+Measure start-up time and memory of the modules loaded by each kind of process.
+Every measure runs in a fresh interpreter.
+
+    python -m benchmarks.import_time
+"""
+import argparse
+import subprocess
+import sys
+
+# what each kind of process imports before doing any work
+TARGETS = {
+    'main': 'import main',
+    'scraper': 'import scraper',
+    'bot': 'import bot',
+    'scraper+firestore': 'import scraper, firebase_admin.firestore',
+    'bot+firestore': 'import bot, firebase_admin.firestore',
+}
+
+_PROBE = '''
+import resource, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sys.modules))
+'''
+
+
+def measure(statement, repeat=5):
+    """
+    :return: best import time in seconds, peak RSS in KiB, number of loaded modules
+    """
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(statement=statement)],
+                             check=True, capture_output=True, text=True).stdout.split()
+        elapsed, rss, modules = float(out[0]), int(out[1]), int(out[2])
+        if best is None or elapsed < best[0]:
+            best = (elapsed, rss, modules)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('targets', nargs='*', default=list(TARGETS))
+    args = parser.parse_args()
+
+    for name in args.targets:
+        elapsed, rss, modules = measure(TARGETS[name], args.repeat)
+        print(f'{name:20s} import={elapsed * 1000:8.1f}ms rss={rss / 1024:6.1f}MiB modules={modules}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare memory footprint and (de)serialization throughput of the Line model
+against the previous dict-based implementation.
+
+    python -m benchmarks.line_model --lines 10000 --subscribers 500
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from line import Line
+
+
+class LegacyLine:
+    """
+    Line model before the introduction of __slots__, kept as a baseline.
+    """
+
+    def __init__(self, code, name, url):
+        self.code = code
+        self.name = name
+        self.url = url
+        self.cities = list()
+        self.file_hash = None
+        self.user_subscriptions = list()
+
+    @staticmethod
+    def from_dict(source):
+        line = LegacyLine(source['code'], source['name'], source['timetable_url'])
+        line.cities = list(source['cities'])
+        line.file_hash = source['file_hash']
+        if 'user_subscriptions' in source:
+            line.user_subscriptions = list(source['user_subscriptions'])
+        return line
+
+    def to_dict(self):
+        return {
+            u'code': self.code,
+            u'name': self.name,
+            u'timetable_url': self.url,
+            u'cities': list(self.cities),
+            u'file_hash': self.file_hash,
+            u'user_subscriptions': list(self.user_subscriptions),
+        }
+
+
+def make_documents(n_lines, n_subscribers, seed=0):
+    rnd = random.Random(seed)
+    cities = [f'CITY {i}' for i in range(250)]
+    return [{
+        'code': f'L{i:05d}',
+        'name': f'Linea {i}',
+        'timetable_url': f'https://bit.ly/{i:08x}',
+        'cities': rnd.sample(cities, 8),
+        'file_hash': f'{rnd.getrandbits(256):064x}',
+        # Telegram chat ids are large integers, not interned by CPython
+        'user_subscriptions': [rnd.randrange(10 ** 8, 10 ** 10) for _ in range(n_subscribers)],
+    } for i in range(n_lines)]
+
+
+def measure(cls, n_lines, n_subscribers):
+    """
+    :return: memory retained by the lines, seconds spent in from_dict and in to_dict
+    """
+    tracemalloc.start()
+    # documents are decoded within the trace and then dropped, as the ones read from Firestore
+    documents = make_documents(n_lines, n_subscribers)
+    lines = [cls.from_dict(d) for d in documents]
+    del documents
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # time is measured without tracing, which slows down allocations
+    documents = make_documents(n_lines, n_subscribers)
+    start = time.perf_counter()
+    lines = [cls.from_dict(d) for d in documents]
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for line in lines:
+        line.to_dict()
+    dump = time.perf_counter() - start
+
+    return memory, load, dump
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--subscribers', type=int, default=500)
+    args = parser.parse_args()
+
+    for cls in (LegacyLine, Line):
+        memory, load, dump = measure(cls, args.lines, args.subscribers)
+        print(f'{cls.__name__:10s} memory={memory / 2 ** 20:8.1f}MiB '
+              f'from_dict={args.lines / load:10.0f} lines/s to_dict={args.lines / dump:10.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure the duration of a scraper session against local stand-ins of
+grandabus.it, Bit.ly and Firestore.
+
+    python -m benchmarks.scrape --lines 300 --service-latency 0.01 --executor process --workers 4
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault('BITLY_ACCESS_TOKEN', 'benchmark')
+
+import utils.bitly_utils as bitly_utils  # noqa: E402
+from benchmarks.datasets import Dataset  # noqa: E402
+from benchmarks.fake_services import FakeServices  # noqa: E402
+from benchmarks.fakes import FakeFirestore  # noqa: E402
+from scraper import GrandaBusScraper  # noqa: E402
+from scraper.processing import create_executor, PROCESS, THREAD  # noqa: E402
+from utils.http_utils import close_sessions  # noqa: E402
+
+
+def _session(scraper):
+    async def run():
+        try:
+            await scraper.run()
+        finally:
+            # the shared aiohttp session is bound to the loop being closed
+            await close_sessions()
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - start
+
+
+def run(dataset: Dataset, firestore_latency=0.0, service_latency=0.0, changed_lines=10,
+        executor=PROCESS, workers=None):
+    """
+    Run three sessions: a cold one on an empty database, one on an unchanged
+    page and a full one after `changed_lines` timetables changed.
+    :param executor: kind of executor hashing and parsing the pdfs
+    :param workers: number of workers of the executor
+    :return: list of (session name, seconds, Firestore round trips, HTTP requests)
+    """
+    results = list()
+
+    with FakeServices(dataset, service_latency) as services, create_executor(executor, workers) as pool:
+        bitly_utils.BITLY_ENDPOINT = services.url('/v4/shorten')
+        firestore = FakeFirestore(firestore_latency)
+
+        scraper = GrandaBusScraper(firestore, url=services.url('/orari-per-localita/'),
+                                   shorten_delay=(0, 0), download_delay=(0, 0),
+                                   executor=pool, workers=workers)
+        scraper.on_lines_deleted = lambda lines: None
+        scraper.on_lines_file_changed = lambda lines: None
+
+        def measure(name):
+            round_trips, requests = firestore.round_trips, services.requests
+            elapsed = _session(scraper)
+            results.append((name, elapsed, firestore.round_trips - round_trips, services.requests - requests))
+
+        measure('cold')
+        measure('unchanged')
+
+        for line in dataset.lines[:changed_lines]:
+            dataset.versions[line['code']] += 1
+        scraper.do_not_overwrite_if_unchanged = False
+        measure('changed')
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=300)
+    parser.add_argument('--cities', type=int, default=250)
+    parser.add_argument('--pdf-size', type=int, default=200 * 1024, help='bytes of every timetable')
+    parser.add_argument('--firestore-latency', type=float, default=0.02, help='seconds per Firestore round trip')
+    parser.add_argument('--service-latency', type=float, default=0.01, help='seconds per HTTP request')
+    parser.add_argument('--executor', choices=(PROCESS, THREAD), default=PROCESS,
+                        help='where timetables are hashed and parsed')
+    parser.add_argument('--workers', type=int, help='workers of the executor (default: one per core)')
+    args = parser.parse_args()
+
+    dataset = Dataset(n_lines=args.lines, n_cities=args.cities, pdf_size=args.pdf_size)
+    for name, elapsed, round_trips, requests in run(dataset, args.firestore_latency, args.service_latency,
+                                                    executor=args.executor, workers=args.workers):
+        print(f'scrape {name:10s} {elapsed:8.2f}s firestore={round_trips:5d} http={requests:5d}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,22 @@ from telegram.ext import Updater
 from telegram.ext import messagequeue as mq
 
 from .handlers import register_all_handlers
+from .metrics import metrics, CountingProxy, HTTP_CALLS, BOT_API_IO_METHODS
 
 
 class GrandaBusBot(Updater):
+    # default number of dispatcher worker threads running the run_async handlers
+    DEFAULT_WORKERS = 8
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, *args, workers=DEFAULT_WORKERS, **kwargs):
+        """Constructor
+
+        :param workers: number of dispatcher worker threads
+        """
+        super().__init__(*args, workers=workers, **kwargs)
+        # count the Bot API calls (replies, documents, callback answers, ...) as outbound HTTP calls
+        self.bot._request = CountingProxy(self.bot._request, metrics, HTTP_CALLS,
+                                          io_methods=BOT_API_IO_METHODS, ref_methods=frozenset())
         self._is_messages_queued_default = True
         self._msg_queue = mq.MessageQueue()
 
@@ -19,6 +29,23 @@ class GrandaBusBot(Updater):
         register_all_handlers(self)
         self.start_polling(*args, **kwargs)
 
+    def run_webhook(self, listen='127.0.0.1', port=8443, url_path='', webhook_url=None, **kwargs):
+        """
+        Attach all the handlers and receive the updates through a webhook.
+
+        Updates are received by a local HTTP server and dispatched to the
+        dispatcher worker pool (see the `workers` argument of the constructor).
+        When the bot runs behind a reverse proxy, `webhook_url` is the public
+        URL forwarded by the proxy to `http://{listen}:{port}/{url_path}`.
+
+        :param listen: address the HTTP server binds to
+        :param port: port the HTTP server listens on
+        :param url_path: path of the webhook endpoint (use a secret, e.g. the bot token)
+        :param webhook_url: public URL registered on Telegram
+        """
+        register_all_handlers(self)
+        self.start_webhook(listen=listen, port=port, url_path=url_path, webhook_url=webhook_url, **kwargs)
+
     def add_handler(self, *args, **kwargs):
         """
         Shortcut for dispatcher.add_handler(*args, **kwargs)
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class LastSessionCache:
+    """
+    In-memory copy of the `scraper/last_session` document.
+
+    The scraper pushes the new date through `set` as soon as a session is saved.
+    A short TTL covers the case of a scraper running in another process.
+    """
+
+    # seconds after which the value is read again from Firestore
+    TTL = 10 * 60
+
+    def __init__(self, ttl=TTL):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._date = None
+        self._expires_at = 0
+
+    def set(self, date):
+        """
+        Store the date of the last scraper session
+        :param date: when the last session was saved
+        """
+        with self._lock:
+            self._date = date
+            self._expires_at = time.monotonic() + self._ttl
+
+    def get(self, firestore):
+        """
+        Get the date of the last scraper session, reading it from Firestore
+        only if the cached value expired.
+        :param firestore: Firestore client
+        :return: date of the last session if available, None otherwise
+        """
+        if time.monotonic() < self._expires_at:
+            return self._date
+
+        doc = firestore.collection('scraper').document('last_session').get()
+        date = doc.to_dict()['date'] if doc.exists else None
+        self.set(date)
+        return date
+
+
+last_session = LastSessionCache()
@@ -1,13 +1,16 @@
 import logging
+import time
 from functools import wraps
 
-from firebase_admin import firestore
 from telegram import Update
 from telegram.ext import CallbackContext
 
+from .metrics import metrics, CountingProxy
+
 
 def exception_logger(logger: logging.Logger):
     def decorator(func):
+        @wraps(func)
         def wrapper(*args, **kwargs):
             try:
                 return func(*args, **kwargs)
@@ -36,6 +39,15 @@ def send_action(chat_action):
 __cached_firestore_client = None
 
 
+def set_firestore_client(client):
+    """
+    Override the Firestore client injected by with_firestore (e.g. with a local stand-in).
+    :param client: Firestore client
+    """
+    global __cached_firestore_client
+    __cached_firestore_client = client
+
+
 # decorator that injects a firestore instance
 def with_firestore():
     def wrapper(func):
@@ -44,11 +56,60 @@ def with_firestore():
             global __cached_firestore_client
 
             if __cached_firestore_client is None:
+                # firebase_admin (and grpc) are only loaded by the first handler needing them
+                from firebase_admin import firestore
                 __cached_firestore_client = firestore.client()
 
-            kwargs['firestore'] = __cached_firestore_client
+            kwargs['firestore'] = CountingProxy(__cached_firestore_client, metrics)
             return func(update, context, *args, **kwargs)
 
         return wrapped
 
     return wrapper
+
+
+# seconds before telling the user that the answer is taking longer than usual
+REPLY_TIMEOUT = 3
+
+
+# decorator that sends a fallback reply when the handler takes longer than `seconds`.
+# The handler is not interrupted: its reply is still delivered when ready.
+# The fallback is a job of the bot job queue, so no thread is started per update.
+def reply_timeout(seconds, fallback):
+    def send_fallback(context: CallbackContext):
+        context.bot.send_message(context.job.context, fallback)
+
+    def wrapper(func):
+        @wraps(func)
+        def wrapped(update: Update, context: CallbackContext, *args, **kwargs):
+            if context.job_queue is None:
+                return func(update, context, *args, **kwargs)
+
+            job = context.job_queue.run_once(send_fallback, seconds, context=update.effective_chat.id)
+            try:
+                return func(update, context, *args, **kwargs)
+            finally:
+                job.schedule_removal()
+
+        return wrapped
+
+    return wrapper
+
+
+# decorator that records the handler latency and the calls made while serving the update
+def timed(name=None):
+    def wrapper(func):
+        handler = name or func.__name__
+
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            outermost = metrics.begin_update()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.end_update(handler, (time.perf_counter() - start) * 1000, outermost)
+
+        return wrapped
+
+    return wrapper
@@ -1,7 +1,11 @@
+from telegram import Update
 from telegram.ext import CommandHandler, MessageHandler, \
-    Filters, CallbackQueryHandler
+    Filters, CallbackQueryHandler, TypeHandler, InlineQueryHandler
 
 from bot.handlers import states
+from bot.throttling import UpdateThrottle
+from .departures import on_next_departures_command
+from .inline import on_inline_query
 from .location import on_got_user_location
 from .search import *
 from .start import on_start_command, on_disclaimer_command
@@ -13,16 +17,31 @@ def error(update, context):
     logger.error('Update "%s" caused error "%s"', update, context.error)
 
 
+# handlers of the updates are registered in group 0, after the throttle
+THROTTLE_GROUP = -1
+
+
 def register_all_handlers(bot):
+    # drop the updates of chats sending too many of them, before any handler runs
+    bot.add_handler(TypeHandler(Update, UpdateThrottle()), group=THROTTLE_GROUP)
+
+    # Handlers are run_async: they run on the dispatcher worker pool, so a slow
+    # Firestore, LocationIQ or Bot API call does not block the updates of other
+    # users. ConversationHandler resolves the Promise returned by the handlers
+    # of its states (none of them is persistent).
     bot.add_handler(CommandHandler('disclaimer', on_disclaimer_command))
     bot.add_handler(CommandHandler('start', on_start_command))
     bot.add_handler(CommandHandler('menu', on_start_command))
+    bot.add_handler(CommandHandler('prossimo', on_next_departures_command))
 
     bot.add_handler(CallbackQueryHandler(on_enable_notifications, pattern=r'enable_notif_\d*'))
     bot.add_handler(CallbackQueryHandler(on_disable_notifications, pattern=r'disable_notif_\d*'))
+    bot.add_handler(CallbackQueryHandler(on_city_page, pattern=r'city_page_\d+_.+'))
 
     bot.add_handler(MessageHandler(Filters.location, on_got_user_location))
 
+    bot.add_handler(InlineQueryHandler(on_inline_query))
+
     bot.add_handler(ConversationHandler(
         name='search_by_line_code',
         entry_points=[MessageHandler(Filters.regex("Cerca per codice linea"),
@@ -0,0 +1,40 @@
+import datetime
+import logging
+
+import pytz
+from telegram import Update, ChatAction
+from telegram.ext import CallbackContext
+from telegram.ext.dispatcher import run_async
+
+import bot.handlers.strings as strings
+from bot.decorators import send_action, with_firestore, exception_logger, timed, reply_timeout, REPLY_TIMEOUT
+from bot.timetables import timetables
+from line import normalize_city
+
+logger = logging.getLogger(__name__)
+
+# timezone of the timetables
+TIMEZONE = pytz.timezone('Europe/Rome')
+
+
+@run_async
+@timed()
+@exception_logger(logger)
+@send_action(ChatAction.TYPING)
+@reply_timeout(REPLY_TIMEOUT, strings.slow_response_message())
+@with_firestore()
+def on_next_departures_command(update: Update, context: CallbackContext, firestore):
+    logger.info(f'User {update.effective_user.id} issued: /prossimo {context.args}')
+
+    # arguments made only of slashes and spaces normalize to no city
+    city = normalize_city(' '.join(context.args))
+    if not city:
+        update.message.reply_text(strings.next_departures_usage_message())
+        return
+    now = datetime.datetime.now(TIMEZONE)
+    departures = timetables.next_departures(city, now.hour * 60 + now.minute, now.weekday(), firestore)
+
+    if departures:
+        update.message.reply_html(strings.next_departures_message(city, departures))
+    else:
+        update.message.reply_text(strings.no_departures_found_message())
@@ -0,0 +1,25 @@
+import logging
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.ext.dispatcher import run_async
+
+from bot.decorators import exception_logger, timed
+from bot.inline import inline_results
+
+logger = logging.getLogger(__name__)
+
+# seconds Telegram keeps the answer of a query for every user
+INLINE_CACHE_TIME = 10 * 60
+
+
+@run_async
+@timed()
+@exception_logger(logger)
+def on_inline_query(update: Update, _: CallbackContext):
+    query = update.inline_query
+    offset = int(query.offset) if query.offset else 0
+
+    results, next_offset = inline_results.search(query.query, offset)
+    query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False,
+                 next_offset=str(next_offset) if next_offset is not None else '')
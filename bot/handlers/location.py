@@ -1,37 +1,71 @@
 import logging
-import os
 
-import requests
-from telegram import Update, ReplyKeyboardRemove
+from telegram import Update, ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import CallbackContext
+from telegram.ext.dispatcher import run_async
 
 import bot.handlers.strings as strings
-from bot.decorators import with_firestore, exception_logger
+from bot.decorators import with_firestore, exception_logger, timed, reply_timeout, REPLY_TIMEOUT
+from bot.metrics import metrics, HTTP_CALLS
+from bot.rendering import responses
+from config import config
+from line import normalize_city
+from .search import reply_city_pages
+from utils.http_utils import get_session, CONNECT_TIMEOUT
+from utils.resilience import RejectedError, locationiq_breaker
 
 logger = logging.getLogger(__name__)
 
-if 'LOCATIONIQ_API_KEY' not in os.environ:
-    raise ValueError('Missing LOCATIONIQ_API_KEY environment variable')
-LOCATIONIQ_API_KEY = os.environ['LOCATIONIQ_API_KEY']
+LOCATIONIQ_ENDPOINT = "https://us1.locationiq.com/v1/reverse.php"
 
+# seconds before giving up on LocationIQ
+LOCATIONIQ_TIMEOUT = 5
 
-def reverse_geocode_city(latitude, longitude):
-    url = "https://us1.locationiq.com/v1/reverse.php"
-
-    response = requests.get(url, params={
-        'key': LOCATIONIQ_API_KEY,
-        'lat': str(latitude),
-        'lon': str(longitude),
-        'format': 'json'
-    })
-
-    if response.status_code == 200:
-        return response.json()['address']['city']
-    else:
-        raise IOError(f'Cannot reverse geocode ({latitude},{longitude}). LocationIQ replied {response.text}')
+# counter of the locations answered without LocationIQ
+LOCATIONIQ_FALLBACKS = 'locationiq_fallbacks'
 
 
+def reverse_geocode_city(latitude, longitude):
+    """
+    Find the city of a location through LocationIQ.
+    :raise IOError: if the location cannot be resolved, or LocationIQ is unavailable
+                    (CircuitOpenError while it keeps failing)
+    :raise KeyError: if the location has no city
+    :raise ValueError: if LocationIQ replied with an invalid body
+    """
+    def request():
+        metrics.count(HTTP_CALLS)
+        response = get_session().get(LOCATIONIQ_ENDPOINT, params={
+            'key': config.locationiq_api_key,
+            'lat': str(latitude),
+            'lon': str(longitude),
+            'format': 'json'
+        }, timeout=(CONNECT_TIMEOUT, LOCATIONIQ_TIMEOUT))
+
+        if 400 <= response.status_code < 500:
+            # e.g. 404 "Unable to geocode" for a location in the middle of nowhere: LocationIQ is available
+            raise RejectedError(f'Cannot reverse geocode ({latitude},{longitude}). LocationIQ replied {response.text}')
+        if response.status_code != 200:
+            raise IOError(f'LocationIQ replied {response.status_code}: {response.text}')
+        return response
+
+    return locationiq_breaker.call(request).json()['address']['city']
+
+
+def reply_type_your_city(update: Update):
+    """
+    Fallback used when the location cannot be resolved: ask the user to search by city.
+    """
+    metrics.count(LOCATIONIQ_FALLBACKS)
+    markup = ReplyKeyboardMarkup([[KeyboardButton(u'🏙️ Cerca per località')]],
+                                 resize_keyboard=True, one_time_keyboard=True)
+    update.message.reply_text(strings.location_unavailable_message(), reply_markup=markup)
+
+
+@run_async
+@timed()
 @exception_logger(logger)
+@reply_timeout(REPLY_TIMEOUT, strings.slow_response_message())
 @with_firestore()
 def on_got_user_location(update: Update, context: CallbackContext, firestore):
     location = update.message.location
@@ -40,18 +74,17 @@ def on_got_user_location(update: Update, context: CallbackContext, firestore):
         raise ValueError('Expected location payload not found')
 
     # try to extract city name from location
-    city = reverse_geocode_city(location.latitude, location.longitude).upper()
-
-    lines_ref = firestore.collection('lines')
-    lines = lines_ref.where(u'cities', u'array_contains', city).stream()
-    lines = map(lambda l: l.to_dict(), lines)
+    try:
+        city = normalize_city(reverse_geocode_city(location.latitude, location.longitude))
+    except (IOError, KeyError, ValueError) as e:
+        logger.warning(f'Cannot resolve the location of user {update.effective_user.id}: {e!r}')
+        reply_type_your_city(update)
+        return
 
-    res = ''
-    for line in lines:
-        res += strings.short_line_descr(line['code'], line['name'], line['timetable_url'])
+    pages = responses.city(city, firestore)
 
-    if res:
-        update.message.reply_html(res, disable_web_page_preview=True)
+    if pages:
+        reply_city_pages(update, city, pages)
     else:
         update.message.reply_text(strings.no_line_found_by_location())
 
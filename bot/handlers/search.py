@@ -1,29 +1,34 @@
 import logging
 
-from firebase_admin import firestore as firestore_api
-from telegram import (
-    Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove)
+from telegram import Update, ReplyKeyboardRemove, ParseMode
 from telegram.ext import ConversationHandler, CallbackContext
+from telegram.ext.dispatcher import run_async
 
-from bot.decorators import exception_logger, with_firestore
+import bot.handlers.strings as strings
+from bot.decorators import exception_logger, with_firestore, timed, reply_timeout, REPLY_TIMEOUT
 from bot.handlers import states
+from bot.rendering import (responses, city_page_keyboard, get_enable_notifications_btn,
+                           get_disable_notifications_btn, CITY_PAGE_CALLBACK_PREFIX)
+from bot.subscriptions import subscriptions
+from line import normalize_city
 from .start import on_start_command
 
 logger = logging.getLogger(__name__)
 
 
-def _get_enable_notifications_btn(code):
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton(text="Abilita notifiche", callback_data=f'enable_notif_{code}')]
-    ])
-
-
-def _get_disable_notifications_btn(code):
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton(text="Disabilita notifiche", callback_data=f'disable_notif_{code}')]
-    ])
+def reply_city_pages(update: Update, city, pages):
+    """
+    Reply with the first page of the results of a search by city.
+    :param update: incoming update
+    :param city: normalized city name
+    :param pages: rendered pages
+    """
+    update.message.reply_html(pages[0], disable_web_page_preview=True,
+                              reply_markup=city_page_keyboard(city, 0, len(pages)))
 
 
+@run_async
+@timed()
 @exception_logger(logger)
 def on_start_searching_by_line(update: Update, _):
     update.message.reply_text(
@@ -32,6 +37,8 @@ def on_start_searching_by_line(update: Update, _):
     return states.WAITING
 
 
+@run_async
+@timed()
 @exception_logger(logger)
 def on_start_searching_by_location(update: Update, _):
     update.message.reply_text(
@@ -40,30 +47,26 @@ def on_start_searching_by_location(update: Update, _):
     return states.WAITING
 
 
+@run_async
+@timed()
 @exception_logger(logger)
 def on_back_to_menu(update: Update, context):
     on_start_command(update, context)
     return ConversationHandler.END
 
 
+@run_async
+@timed()
 @exception_logger(logger)
+@reply_timeout(REPLY_TIMEOUT, strings.slow_response_message())
 @with_firestore()
 def on_search_by_location(update: Update, context, firestore):
-    # instantiate a new Firestore client
-    name = update.message.text
+    city = normalize_city(update.message.text)
 
-    lines_ref = firestore.collection('lines')
-    lines = lines_ref.where(u'cities', u'array_contains', name.upper()).stream()
+    pages = responses.city(city, firestore)
 
-    response = ''
-    for line in lines:
-        line = line.to_dict()
-        response += f'👉 <b>{line["code"]}</b>\n' \
-                    f'<b>Nome linea: </b>{line["name"]}\n' \
-                    f'<b>Orari: </b>{line["timetable_url"]}\n\n'
-
-    if response:
-        update.message.reply_html(response, disable_web_page_preview=True)
+    if pages:
+        reply_city_pages(update, city, pages)
     else:
         update.message.reply_text(
             "Nessuna linea trovata. Prova con un'altra città")
@@ -71,33 +74,26 @@ def on_search_by_location(update: Update, context, firestore):
     context.bot.send_message(chat_id=update.effective_chat.id,
                              text="Tocca /menu per tornare al menu")
 
-    return ConversationHandler.END if response else states.WAITING
+    return ConversationHandler.END if pages else states.WAITING
 
 
+@run_async
+@timed()
 @exception_logger(logger)
+@reply_timeout(REPLY_TIMEOUT, strings.slow_response_message())
 @with_firestore()
 def on_search_by_line(update: Update, context, firestore):
-    # instantiate a new Firestore client
     name = update.message.text
 
-    line = firestore.collection('lines').document(name).get()
-    found = line.exists
+    line = responses.line(name, firestore)
+    found = line is not None
 
     if not found:
         update.message.reply_html(f'😕 Impossibile trovare la linea {name}.')
     else:
-        line = line.to_dict()
-        cities = str.join('\n', map(lambda c: f' - {c}', line['cities']))
-
-        if 'user_subscriptions' in line and update.effective_chat.id in line['user_subscriptions']:
-            reply_markup = _get_disable_notifications_btn(line["code"])
-        else:
-            reply_markup = _get_enable_notifications_btn(line["code"])
-
-        update.message.reply_html(f'👉 <b>{line["code"]}</b>\n'
-                                  f'<b>Nome linea: </b>{line["name"]}\n\n'
-                                  f'<b>Paesi: </b>\n{cities}\n\n', reply_markup=reply_markup)
-        context.bot.send_document(chat_id=update.effective_chat.id, document=line['timetable_url'])
+        subscribed = subscriptions.is_subscribed(line.code, update.effective_chat.id, firestore)
+        update.message.reply_html(line.text, reply_markup=line.reply_markup(subscribed))
+        context.bot.send_document(chat_id=update.effective_chat.id, document=line.timetable_url)
 
     context.bot.send_message(chat_id=update.effective_chat.id,
                              text="Tocca /menu per tornare al menu")
@@ -105,27 +101,49 @@ def on_search_by_line(update: Update, context, firestore):
     return ConversationHandler.END if found else states.WAITING
 
 
+@run_async
+@timed()
 @exception_logger(logger)
 @with_firestore()
 def on_enable_notifications(update: Update, context: CallbackContext, firestore):
     code = update.callback_query.data.replace("enable_notif_", "")
 
-    doc = firestore.collection(u'lines').document(code)
+    # written with the other toggles of the next seconds
+    subscriptions.set(code, update.effective_chat.id, True, firestore)
 
-    doc.update({u'user_subscriptions': firestore_api.ArrayUnion([update.effective_chat.id])})
-
-    update.callback_query.edit_message_reply_markup(reply_markup=_get_disable_notifications_btn(code))
+    update.callback_query.edit_message_reply_markup(reply_markup=get_disable_notifications_btn(code))
     context.bot.answer_callback_query(update.callback_query.id, text='Notifiche abilitate')
 
 
+@run_async
+@timed()
 @exception_logger(logger)
 @with_firestore()
 def on_disable_notifications(update: Update, context, firestore):
     code = update.callback_query.data.replace("disable_notif_", "")
 
-    doc = firestore.collection(u'lines').document(code)
-
-    doc.update({u'user_subscriptions': firestore_api.ArrayRemove([update.effective_chat.id])})
+    # written with the other toggles of the next seconds
+    subscriptions.set(code, update.effective_chat.id, False, firestore)
 
-    update.callback_query.edit_message_reply_markup(reply_markup=_get_enable_notifications_btn(code))
+    update.callback_query.edit_message_reply_markup(reply_markup=get_enable_notifications_btn(code))
     context.bot.answer_callback_query(update.callback_query.id, text='Notifiche disabilitate')
+
+
+@run_async
+@timed()
+@exception_logger(logger)
+@with_firestore()
+def on_city_page(update: Update, context: CallbackContext, firestore):
+    page, token = update.callback_query.data.replace(CITY_PAGE_CALLBACK_PREFIX, "").split('_', 1)
+    page = int(page)
+
+    city = responses.city_from_token(token)
+    pages = responses.city(city, firestore) if city else ()
+    if page >= len(pages):
+        # results changed since the first page was sent
+        context.bot.answer_callback_query(update.callback_query.id, text='Risultati aggiornati, ripeti la ricerca')
+        return
+
+    update.callback_query.edit_message_text(pages[page], parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+                                            reply_markup=city_page_keyboard(city, page, len(pages)))
+    context.bot.answer_callback_query(update.callback_query.id)
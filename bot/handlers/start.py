@@ -3,14 +3,18 @@ import logging
 from telegram import (ChatAction,
                       Update, ReplyKeyboardMarkup,
                       ParseMode, KeyboardButton, ReplyKeyboardRemove)
+from telegram.ext.dispatcher import run_async
 
-from bot.decorators import send_action, with_firestore
-from .strings import disclaimer_message
+from bot.cache import last_session
+from bot.decorators import send_action, with_firestore, timed, reply_timeout, REPLY_TIMEOUT
+from .strings import disclaimer_message, slow_response_message
 from .strings import start_message
 
 logger = logging.getLogger(__name__)
 
 
+@run_async
+@timed()
 @send_action(ChatAction.TYPING)
 def on_disclaimer_command(update: Update, _):
     logger.info(f'User {update.effective_user.id} issued: /disclaimer')
@@ -20,13 +24,15 @@ def on_disclaimer_command(update: Update, _):
                                   reply_markup=ReplyKeyboardRemove())
 
 
+@run_async
+@timed()
 @send_action(ChatAction.TYPING)
+@reply_timeout(REPLY_TIMEOUT, slow_response_message())
 @with_firestore()
 def on_start_command(update: Update, context, firestore):
     logger.info(f'User {update.effective_user.id} issued: /start')
 
-    doc = firestore.collection('scraper').document('last_session').get()
-    date = doc.to_dict()['date'] if doc.exists else None
+    date = last_session.get(firestore)
 
     markup = ReplyKeyboardMarkup([
         [KeyboardButton(u'🔢 Cerca per codice linea')],
@@ -41,3 +41,31 @@ def no_line_found_by_location():
 
 def get_go_to_menu_message():
     return "Tocca /menu per tornare al menu"
+
+
+def slow_response_message():
+    return "⏳ Ci sto mettendo più del previsto, attendi ancora qualche secondo..."
+
+
+def next_departures_usage_message():
+    return "Scrivi /prossimo seguito dal nome di una città, ad esempio /prossimo Cuneo"
+
+
+def no_departures_found_message():
+    return "Nessuna partenza trovata. Prova con un'altra città o più tardi"
+
+
+def next_departures_message(city, departures):
+    def hhmm(minute):
+        return f'{minute // 60 % 24:02}:{minute % 60:02}'
+
+    rows = [f'🚌 <b>{code}</b> {stop}: {", ".join(hhmm(m) for m in minutes)}'
+            for code, stop, minutes in departures]
+    return (f'<b>Prossime partenze da {city}</b>\n\n' + '\n'.join(rows) +
+            '\n\n<i>Gli orari non tengono conto di festività e calendario scolastico: '
+            'verifica sul PDF della linea</i>')
+
+
+def location_unavailable_message():
+    return ("Non riesco a capire in quale città ti trovi. "
+            "Tocca \"Cerca per località\" e digita il nome della tua città")
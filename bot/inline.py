@@ -0,0 +1,92 @@
+import threading
+from bisect import bisect_left
+from typing import List
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent, ParseMode
+
+import bot.handlers.strings as strings
+from line import Line, normalize_city
+from .rendering import render_city
+
+# Telegram accepts at most 50 results per answer
+MAX_INLINE_RESULTS = 50
+
+
+def _line_result(result_id, line: Line):
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=f'{line.code} - {line.name}',
+        description=', '.join(line.cities),
+        input_message_content=InputTextMessageContent(strings.short_line_descr(line.code, line.name, line.url),
+                                                      parse_mode=ParseMode.HTML,
+                                                      disable_web_page_preview=True))
+
+
+def _city_result(result_id, city, lines: List[Line]):
+    pages = render_city({'code': l.code, 'name': l.name, 'timetable_url': l.url} for l in lines)
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=city,
+        description=', '.join(sorted(l.code for l in lines)),
+        input_message_content=InputTextMessageContent(pages[0], parse_mode=ParseMode.HTML,
+                                                      disable_web_page_preview=True))
+
+
+class InlineIndex:
+    """
+    Answers of the inline queries, built from the lines saved by the scraper.
+
+    Every line code and city is a key of a sorted list, paired with its
+    pre-built results: a query is answered with the results of the keys it is
+    a prefix of, found with a binary search, without reading Firestore.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = ()
+        self._results = ()
+
+    def reload(self, lines: List[Line]):
+        """
+        Rebuild the index.
+        :param lines: lines just saved by the scraper
+        """
+        by_city = dict()
+        for line in lines:
+            for city in line.cities:
+                by_city.setdefault(normalize_city(city), list()).append(line)
+
+        entries = [(line.code.upper(), _line_result(f'l{i}', line)) for i, line in enumerate(lines)]
+        entries += [(city, _city_result(f'c{i}', city, city_lines))
+                    for i, (city, city_lines) in enumerate(by_city.items())]
+        entries.sort(key=lambda entry: entry[0])
+
+        keys = tuple(key for key, _ in entries)
+        results = tuple(result for _, result in entries)
+        with self._lock:
+            self._keys, self._results = keys, results
+
+    def search(self, query, offset=0, limit=MAX_INLINE_RESULTS):
+        """
+        :param query: text typed by the user (a line code or a city, or their beginning)
+        :param offset: index of the first result
+        :param limit: maximum number of results
+        :return: tuple (results, offset of the next results or None)
+        """
+        prefix = normalize_city(query)
+        if not prefix:
+            return (), None
+
+        with self._lock:
+            keys, results = self._keys, self._results
+
+        start = bisect_left(keys, prefix) + offset
+        end = start
+        while end < len(keys) and end - start < limit and keys[end].startswith(prefix):
+            end += 1
+
+        has_more = end < len(keys) and keys[end].startswith(prefix)
+        return results[start:end], offset + limit if has_more else None
+
+
+inline_results = InlineIndex()
@@ -0,0 +1,213 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# upper bounds of the per-update calls histogram buckets
+CALLS_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+# names of the counters incremented while serving an update
+FIRESTORE_CALLS = 'firestore'
+HTTP_CALLS = 'http'
+
+
+class Histogram:
+    """
+    Fixed buckets histogram. The last bucket counts all the samples
+    greater than the highest bound.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile using the upper bound of the bucket it falls in.
+        :param q: quantile in [0, 1]
+        :return: the bucket upper bound, or inf if it falls in the last bucket
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+
+class Metrics:
+    """
+    Thread-safe registry of the bot metrics.
+
+    For each handler it keeps a latency histogram and a histogram of the number
+    of Firestore and outbound HTTP calls performed while serving a single update.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = dict()
+        self._calls = dict()
+        self._counters = dict()
+        self._local = threading.local()
+
+    def begin_update(self):
+        """
+        Open a new per-update scope on the current thread.
+        Nested scopes are merged with the outermost one.
+        :return: true if this call opened the outermost scope
+        """
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        if depth == 0:
+            self._local.calls = dict()
+        return depth == 0
+
+    def end_update(self, handler, elapsed_ms, outermost):
+        """
+        Close the scope opened by begin_update and record its measurements.
+        :param handler: name of the handler
+        :param elapsed_ms: time spent inside the handler
+        :param outermost: value returned by the matching begin_update
+        """
+        self._local.depth -= 1
+
+        with self._lock:
+            self._histogram(self._latencies, handler, LATENCY_BUCKETS_MS).observe(elapsed_ms)
+
+            if outermost:
+                calls = self._local.calls
+                for kind in (FIRESTORE_CALLS, HTTP_CALLS):
+                    self._histogram(self._calls, (handler, kind), CALLS_BUCKETS).observe(calls.get(kind, 0))
+
+    def count(self, kind, n=1):
+        """
+        Increment a counter, both globally and inside the current update scope.
+        :param kind: name of the counter
+        :param n: increment
+        """
+        calls = getattr(self._local, 'calls', None)
+        if calls is not None and getattr(self._local, 'depth', 0):
+            calls[kind] = calls.get(kind, 0) + n
+
+        with self._lock:
+            self._counters[kind] = self._counters.get(kind, 0) + n
+
+    def summary(self):
+        """
+        :return: a human readable summary of all the metrics collected so far
+        """
+        with self._lock:
+            rows = [f'{k}: {v}' for k, v in sorted(self._counters.items())]
+
+            for handler, h in sorted(self._latencies.items()):
+                rows.append(f'{handler}: n={h.count} mean={h.mean:.1f}ms '
+                            f'p50<={h.quantile(.5)}ms p95<={h.quantile(.95)}ms p99<={h.quantile(.99)}ms')
+
+            for (handler, kind), h in sorted(self._calls.items()):
+                rows.append(f'{handler} {kind} calls/update: mean={h.mean:.2f} max<={h.quantile(1)}')
+
+        return '\n'.join(rows)
+
+    def log_summary(self, *_):
+        """
+        Write the summary to the log. Can be scheduled on the bot job queue.
+        """
+        logger.info(f'Metrics summary\n{self.summary()}')
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Expose the summary over HTTP on a background thread.
+        :param port: local port
+        :param host: interface to bind to (localhost by default)
+        :return: the HTTP server
+        """
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.summary().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        logger.info(f'Metrics available at http://{host}:{port}/')
+        return server
+
+    @staticmethod
+    def _histogram(histograms, key, bounds):
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = Histogram(bounds)
+        return h
+
+
+# methods of the Firestore client and references performing a round trip
+FIRESTORE_IO_METHODS = frozenset(('get', 'stream', 'set', 'update', 'delete', 'commit', 'create'))
+# methods of the Firestore client and references returning another reference
+FIRESTORE_REF_METHODS = frozenset(('collection', 'document', 'where', 'order_by', 'limit', 'select'))
+
+# methods of telegram.utils.request.Request performing a Bot API call
+BOT_API_IO_METHODS = frozenset(('post', 'retrieve'))
+
+
+class CountingProxy:
+    """
+    Wrap a Firestore client (or any of the references it returns) and count
+    every call that performs a round trip to the database.
+
+    Other clients can be wrapped passing their own io_methods (e.g. the
+    Request of the bot with BOT_API_IO_METHODS and kind=HTTP_CALLS).
+    """
+
+    def __init__(self, target, registry, kind=FIRESTORE_CALLS,
+                 io_methods=FIRESTORE_IO_METHODS, ref_methods=FIRESTORE_REF_METHODS):
+        self._target = target
+        self._registry = registry
+        self._kind = kind
+        self._io_methods = io_methods
+        self._ref_methods = ref_methods
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._io_methods and name not in self._ref_methods:
+            return attr
+
+        def call(*args, **kwargs):
+            if name in self._io_methods:
+                self._registry.count(self._kind)
+            result = attr(*args, **kwargs)
+            if name in self._ref_methods:
+                return CountingProxy(result, self._registry, self._kind, self._io_methods, self._ref_methods)
+            return result
+
+        return call
+
+
+# process-wide registry
+metrics = Metrics()
@@ -0,0 +1,39 @@
+from typing import List
+
+from telegram import ParseMode
+
+from line import Line
+from .outbox import OutboxMessage
+
+
+def lines_deleted_messages(event_id, lines: List[Line]):
+    """
+    Build the notifications of deleted lines
+    :param event_id: id of the event reporting the deletion
+    :param lines: deleted lines
+    :return: list of outbox messages
+    """
+    return [OutboxMessage(f'{event_id}:{chat}:{line.code}:0', chat, 'message', {
+        'text': f"⚠️⚠️⚠️\nLa linea {line.code} ({line.name}) è stata eliminata.",
+        'parse_mode': ParseMode.MARKDOWN,
+    }) for line in lines for chat in line.user_subscriptions]
+
+
+def lines_file_changed_messages(event_id, lines: List[Line]):
+    """
+    Build the notifications of changed lines: a message and the new timetable
+    :param event_id: id of the event reporting the change
+    :param lines: updated line
+    :return: list of outbox messages
+    """
+    messages = list()
+    for line in lines:
+        for chat in line.user_subscriptions:
+            messages.append(OutboxMessage(f'{event_id}:{chat}:{line.code}:0', chat, 'message', {
+                'text': f"⚠️⚠️⚠️\nLa linea {line.code} ({line.name}) è stata aggiornata.",
+                'parse_mode': ParseMode.MARKDOWN,
+            }))
+            messages.append(OutboxMessage(f'{event_id}:{chat}:{line.code}:1', chat, 'document', {
+                'document': line.url,
+            }))
+    return messages
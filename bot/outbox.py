@@ -0,0 +1,536 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import List
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# counters of the outbox metrics
+OUTBOX_SENT = 'outbox_sent'
+OUTBOX_RETRIED = 'outbox_retried'
+OUTBOX_FAILED = 'outbox_failed'
+
+# states of an outbox message
+PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+
+
+class OutboxMessage:
+    """
+    A message to be delivered to a chat.
+
+    :param key: deduplication key, e.g. '{event id}:{chat id}:{n}'
+    :param chat_id: recipient
+    :param method: 'message' or 'document'
+    :param kwargs: arguments of the bot method (text, document, parse_mode, ...)
+    """
+
+    __slots__ = ('key', 'chat_id', 'method', 'kwargs', 'attempts')
+
+    def __init__(self, key, chat_id, method, kwargs, attempts=0):
+        self.key = key
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"OutboxMessage({self.key})"
+
+
+class Outbox:
+    """
+    Persistent queue of outgoing messages.
+
+    Enqueuing is idempotent on the message key. Dequeued messages are leased
+    for `LEASE` seconds, renewed while they wait in the message queue: if the
+    sender dies before acknowledging them they are delivered again
+    (at-least-once), but a message acknowledged as sent is never enqueued nor
+    delivered twice. Sent messages are kept for `SENT_TTL` seconds, longer
+    than the events replayed by a restarted worker, then purged.
+    """
+
+    # seconds a dequeued message is reserved to the sender
+    LEASE = 60
+    # delivery attempts before giving up on a message
+    MAX_ATTEMPTS = 5
+    # seconds a fan-out is reserved to the worker claiming it
+    FAN_OUT_LEASE = 5 * 60
+    # seconds the sent messages and the fan-outs are kept
+    SENT_TTL = 7 * 24 * 60 * 60
+
+    def enqueue(self, messages: List[OutboxMessage]):
+        raise NotImplementedError
+
+    def fan_out(self, event_id, messages: List[OutboxMessage]):
+        """
+        Enqueue the messages of an event on behalf of a single worker: the
+        first one claiming the event enqueues them, the others return. A
+        fan-out interrupted by a crash is taken over once its lease expired.
+        :param event_id: id of the event
+        :param messages: messages of the event
+        :return: true if the caller enqueued the messages
+        """
+        raise NotImplementedError
+
+    def stale_fan_outs(self):
+        """
+        :return: ids of the events whose fan-out was interrupted: not done and with an expired lease
+        """
+        raise NotImplementedError
+
+    def dequeue(self, limit):
+        """
+        Lease up to `limit` pending messages, oldest first.
+        :return: list of messages
+        """
+        raise NotImplementedError
+
+    def renew(self, keys):
+        """
+        Extend the lease of messages still being delivered.
+        :param keys: keys of the messages
+        """
+        raise NotImplementedError
+
+    def ack(self, keys):
+        """
+        Mark messages as delivered.
+        :param keys: keys of the messages
+        """
+        raise NotImplementedError
+
+    def nack(self, message: OutboxMessage):
+        """
+        Make a message available again after a backoff, or mark it as failed
+        once it reached MAX_ATTEMPTS.
+        """
+        raise NotImplementedError
+
+    def purge(self):
+        """
+        Delete the messages sent and the fan-outs completed more than SENT_TTL seconds ago.
+        :return: number of messages deleted
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _backoff(attempts):
+        return min(2 ** attempts, 15 * 60)
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    kwargs TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    created REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, available_at);
+CREATE TABLE IF NOT EXISTS outbox_fan_outs (
+    event_id TEXT PRIMARY KEY,
+    created REAL NOT NULL
+);
+'''
+
+
+class SqliteOutbox(Outbox):
+    """
+    Outbox stored in a local SQLite database.
+
+    :param path: path of the database file
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.executescript(_SCHEMA)
+
+    def _connection(self):
+        # sqlite connections cannot be shared among threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def enqueue(self, messages: List[OutboxMessage]):
+        db = self._connection()
+        db.execute('BEGIN')
+        try:
+            self._insert(db, messages)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def fan_out(self, event_id, messages: List[OutboxMessage]):
+        db = self._connection()
+        # the claim and the messages are committed together: no lease needed
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            claimed = db.execute('INSERT OR IGNORE INTO outbox_fan_outs (event_id, created) VALUES (?, ?)',
+                                 (event_id, time.time())).rowcount == 1
+            if claimed:
+                self._insert(db, messages)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def stale_fan_outs(self):
+        # fan-outs are committed with their messages, they cannot be interrupted
+        return []
+
+    @staticmethod
+    def _insert(db, messages: List[OutboxMessage]):
+        now = time.time()
+        db.executemany(
+            'INSERT OR IGNORE INTO outbox (key, chat_id, method, kwargs, status, available_at, created) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(m.key, m.chat_id, m.method, json.dumps(m.kwargs), PENDING, now, now) for m in messages])
+
+    def dequeue(self, limit):
+        now = time.time()
+        db = self._connection()
+        # an immediate transaction keeps other senders from leasing the same rows
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute('SELECT key, chat_id, method, kwargs, attempts FROM outbox '
+                              'WHERE status = ? AND available_at <= ? ORDER BY created, key LIMIT ?',
+                              (PENDING, now, limit)).fetchall()
+            db.executemany('UPDATE outbox SET available_at = ? WHERE key = ?',
+                           [(now + self.LEASE, row[0]) for row in rows])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+        return [OutboxMessage(key, chat_id, method, json.loads(kwargs), attempts)
+                for (key, chat_id, method, kwargs, attempts) in rows]
+
+    def renew(self, keys):
+        db = self._connection()
+        db.execute('BEGIN')
+        db.executemany('UPDATE outbox SET available_at = ? WHERE key = ?',
+                       [(time.time() + self.LEASE, key) for key in keys])
+        db.execute('COMMIT')
+
+    def ack(self, keys):
+        now = time.time()
+        db = self._connection()
+        db.execute('BEGIN')
+        db.executemany('UPDATE outbox SET status = ?, sent_at = ? WHERE key = ?', [(SENT, now, key) for key in keys])
+        db.execute('COMMIT')
+
+    def nack(self, message: OutboxMessage):
+        attempts = message.attempts + 1
+        status = FAILED if attempts >= self.MAX_ATTEMPTS else PENDING
+        self._connection().execute('UPDATE outbox SET status = ?, attempts = ?, available_at = ? WHERE key = ?',
+                                   (status, attempts, time.time() + self._backoff(attempts), message.key))
+
+    def purge(self):
+        expired = time.time() - self.SENT_TTL
+        db = self._connection()
+        db.execute('BEGIN')
+        try:
+            deleted = db.execute('DELETE FROM outbox WHERE status = ? AND sent_at < ?', (SENT, expired)).rowcount
+            db.execute('DELETE FROM outbox_fan_outs WHERE created < ?', (expired,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return deleted
+
+
+class FirestoreOutbox(Outbox):
+    """
+    Outbox stored in the `outbox` Firestore collection, one document per
+    message whose id is the message key. Leases are taken with an optimistic
+    update conditioned on the document update time. Fan-outs are documents
+    of the `outbox_fan_outs` collection, whose id is the event id.
+
+    :param firestore_client: Firestore client
+    """
+
+    OUTBOX_COLLECTION = u'outbox'
+    FAN_OUTS_COLLECTION = u'outbox_fan_outs'
+    BATCH_MAXIMUM_SIZE = 500
+
+    def __init__(self, firestore_client):
+        self.fs = firestore_client
+
+    def _get_outbox_collection(self):
+        return self.fs.collection(self.OUTBOX_COLLECTION)
+
+    def enqueue(self, messages: List[OutboxMessage]):
+        from google.api_core.exceptions import Conflict
+        from utils import chunkify
+
+        now = time.time()
+        collection = self._get_outbox_collection()
+
+        for chunk in chunkify(messages, self.BATCH_MAXIMUM_SIZE):
+            documents = [(collection.document(m.key), {
+                u'chat_id': m.chat_id,
+                u'method': m.method,
+                u'kwargs': m.kwargs,
+                u'status': PENDING,
+                u'attempts': 0,
+                u'available_at': now,
+                u'created': now,
+            }) for m in chunk]
+
+            batch = self.fs.batch()
+            for ref, data in documents:
+                batch.create(ref, data)
+            try:
+                batch.commit()
+            except Conflict:
+                # part of the chunk was already enqueued: fall back to one create per message
+                for ref, data in documents:
+                    try:
+                        ref.create(data)
+                    except Conflict:
+                        pass
+
+    def fan_out(self, event_id, messages: List[OutboxMessage]):
+        from google.api_core.exceptions import Conflict, GoogleAPICallError
+
+        now = time.time()
+        ref = self.fs.collection(self.FAN_OUTS_COLLECTION).document(event_id)
+        lease = {u'done': False, u'expires_at': now + self.FAN_OUT_LEASE, u'created': now}
+        try:
+            ref.create(lease)
+        except Conflict:
+            doc = ref.get()
+            data = doc.to_dict()
+            if data['done'] or data['expires_at'] > now:
+                return False
+            try:
+                # take over a fan-out whose worker died
+                ref.update(lease, option=self.fs.write_option(last_update_time=doc.update_time))
+            except GoogleAPICallError:
+                return False
+
+        try:
+            self.enqueue(messages)
+        except Exception:
+            # release the lease, so that a retry takes the fan-out over at once
+            ref.update({u'expires_at': 0})
+            raise
+        ref.update({u'done': True})
+        return True
+
+    def stale_fan_outs(self):
+        docs = self.fs.collection(self.FAN_OUTS_COLLECTION) \
+            .where(u'done', u'==', False) \
+            .where(u'expires_at', u'<', time.time()) \
+            .select([]) \
+            .stream()
+        return [doc.id for doc in docs]
+
+    def dequeue(self, limit):
+        from google.api_core.exceptions import GoogleAPICallError
+
+        now = time.time()
+        docs = self._get_outbox_collection() \
+            .where(u'status', u'==', PENDING) \
+            .where(u'available_at', u'<=', now) \
+            .order_by(u'available_at') \
+            .limit(limit) \
+            .stream()
+
+        messages = list()
+        for doc in docs:
+            try:
+                doc.reference.update({u'available_at': now + self.LEASE},
+                                     option=self.fs.write_option(last_update_time=doc.update_time))
+            except GoogleAPICallError:
+                # leased by another sender in the meantime
+                continue
+
+            data = doc.to_dict()
+            messages.append(OutboxMessage(doc.id, data['chat_id'], data['method'], data['kwargs'], data['attempts']))
+        return messages
+
+    def renew(self, keys):
+        self._update(keys, {u'available_at': time.time() + self.LEASE})
+
+    def ack(self, keys):
+        self._update(keys, {u'status': SENT, u'sent_at': time.time()})
+
+    def _update(self, keys, data):
+        from utils import chunkify
+
+        collection = self._get_outbox_collection()
+        for chunk in chunkify(list(keys), self.BATCH_MAXIMUM_SIZE):
+            batch = self.fs.batch()
+            for key in chunk:
+                batch.update(collection.document(key), data)
+            batch.commit()
+
+    def nack(self, message: OutboxMessage):
+        attempts = message.attempts + 1
+        self._get_outbox_collection().document(message.key).update({
+            u'status': FAILED if attempts >= self.MAX_ATTEMPTS else PENDING,
+            u'attempts': attempts,
+            u'available_at': time.time() + self._backoff(attempts),
+        })
+
+    def purge(self):
+        from utils import chunkify
+
+        expired = time.time() - self.SENT_TTL
+        sent = self._get_outbox_collection() \
+            .where(u'status', u'==', SENT) \
+            .where(u'sent_at', u'<', expired) \
+            .select([]) \
+            .stream()
+        fan_outs = self.fs.collection(self.FAN_OUTS_COLLECTION) \
+            .where(u'created', u'<', expired) \
+            .select([]) \
+            .stream()
+
+        refs = [doc.reference for doc in sent]
+        for chunk in chunkify(refs + [doc.reference for doc in fan_outs], self.BATCH_MAXIMUM_SIZE):
+            batch = self.fs.batch()
+            for ref in chunk:
+                batch.delete(ref)
+            batch.commit()
+        return len(refs)
+
+
+class OutboxSender:
+    """
+    Drain an outbox on a background thread, delivering the messages through
+    the rate limited message queue of the bot.
+
+    A message is acknowledged (or retried) when the message queue completes
+    its delivery; messages still queued after `send_timeout` seconds stay in
+    flight, with their lease renewed, until they complete. Fan-outs
+    interrupted by a crash are handed to `resume_fan_out` (the event id),
+    which enqueues their messages again.
+
+    :param bot: GrandaBusBot instance
+    :param outbox: outbox to drain
+    :param batch_size: messages leased at once, including the ones in flight
+    :param poll_interval: seconds to wait when the outbox is empty
+    :param send_timeout: seconds to wait for a batch to be delivered
+    :param purge_interval: seconds between two purges of the sent messages
+    :param resume_fan_out: callback receiving the id of the events whose fan-out was interrupted
+    :param resume_interval: seconds between two searches of the interrupted fan-outs
+    """
+
+    def __init__(self, bot, outbox: Outbox, batch_size=100, poll_interval=5, send_timeout=60,
+                 purge_interval=60 * 60, resume_fan_out=None, resume_interval=60):
+        self._bot = bot
+        self._outbox = outbox
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._send_timeout = send_timeout
+        self._purge_interval = purge_interval
+        self._resume_fan_out = resume_fan_out
+        self._resume_interval = resume_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        # (message, promise) pairs whose delivery is not complete yet
+        self._in_flight = list()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='outbox-sender', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        next_purge = next_resume = time.monotonic()
+        while not self._stop_event.is_set():
+            if self._resume_fan_out and time.monotonic() >= next_resume:
+                next_resume = time.monotonic() + self._resume_interval
+                try:
+                    for event_id in self._outbox.stale_fan_outs():
+                        logger.warning(f'Outbox: resuming the fan-out of {event_id}')
+                        self._resume_fan_out(event_id)
+                except Exception as e:
+                    logger.error(f'Cannot resume the outbox fan-outs: {e}')
+
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + self._purge_interval
+                try:
+                    logger.info(f'Outbox: purged {self._outbox.purge()} sent messages')
+                except Exception as e:
+                    logger.error(f'Cannot purge the outbox: {e}')
+
+            try:
+                sent = self.send_batch()
+            except Exception as e:
+                logger.error(f'Cannot drain the outbox: {e}')
+                sent = 0
+
+            if not sent:
+                self._stop_event.wait(self._poll_interval)
+
+    def send_batch(self):
+        """
+        Lease and deliver one batch of messages, then settle the messages in flight.
+        :return: number of messages leased
+        """
+        start = time.perf_counter()
+        messages = self._outbox.dequeue(self._batch_size - len(self._in_flight)) \
+            if len(self._in_flight) < self._batch_size else []
+
+        promises = [(m, self._send(m)) for m in messages]
+        deadline = time.monotonic() + self._send_timeout
+        for _, promise in promises:
+            promise.done.wait(timeout=max(0, deadline - time.monotonic()))
+        self._in_flight.extend(promises)
+
+        delivered = self._settle()
+        elapsed = time.perf_counter() - start
+        if messages or delivered:
+            logger.info(f'Outbox: delivered {delivered} messages in {elapsed:.1f}s '
+                        f'({delivered / elapsed:.1f} msg/s), {len(self._in_flight)} in flight')
+        return len(messages)
+
+    def _settle(self):
+        """
+        Acknowledge or retry the messages whose delivery completed, renew the lease of the others.
+        :return: number of messages delivered
+        """
+        delivered, in_flight = list(), list()
+        for message, promise in self._in_flight:
+            if not promise.done.is_set():
+                in_flight.append((message, promise))
+            elif promise.exception is None:
+                delivered.append(message.key)
+            else:
+                logger.error(f'Cannot deliver {message}: {promise.exception}')
+                metrics.count(OUTBOX_FAILED if message.attempts + 1 >= Outbox.MAX_ATTEMPTS else OUTBOX_RETRIED)
+                self._outbox.nack(message)
+
+        self._in_flight = in_flight
+        if in_flight:
+            self._outbox.renew([message.key for message, _ in in_flight])
+        if delivered:
+            self._outbox.ack(delivered)
+            metrics.count(OUTBOX_SENT, len(delivered))
+        return len(delivered)
+
+    def _send(self, message: OutboxMessage):
+        if message.method == 'document':
+            return self._bot.send_queued_document(chat_id=message.chat_id, queued=True, **message.kwargs)
+        return self._bot.send_queued_message(chat_id=message.chat_id, queued=True, **message.kwargs)
@@ -0,0 +1,265 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.constants import MAX_MESSAGE_LENGTH
+
+import bot.handlers.strings as strings
+from line import Line, normalize_city
+
+# Telegram limits callback data to 64 bytes
+MAX_CALLBACK_DATA_LENGTH = 64
+
+CITY_PAGE_CALLBACK_PREFIX = 'city_page_'
+
+# bytes of the callback data left for the city, after the prefix and a page number up to 999
+MAX_CITY_TOKEN_LENGTH = MAX_CALLBACK_DATA_LENGTH - len(CITY_PAGE_CALLBACK_PREFIX) - len('999_')
+
+# prefix of the tokens standing for city names too long for the callback data
+CITY_HASH_TOKEN_PREFIX = '#'
+
+# line codes are numbers, as in the callback data of the notification buttons
+LINE_CODE_RE = re.compile(r'\d+')
+
+
+def get_enable_notifications_btn(code):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text="Abilita notifiche", callback_data=f'enable_notif_{code}')]
+    ])
+
+
+def get_disable_notifications_btn(code):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text="Disabilita notifiche", callback_data=f'disable_notif_{code}')]
+    ])
+
+
+def paginate(entries, max_length=MAX_MESSAGE_LENGTH):
+    """
+    Group entries into pages no longer than max_length characters.
+    :param entries: pieces of text that cannot be split
+    :param max_length: maximum length of a page
+    :return: tuple of pages
+    """
+    pages = list()
+    page = ''
+    for entry in entries:
+        if page and len(page) + len(entry) > max_length:
+            pages.append(page)
+            page = ''
+        page += entry[:max_length]
+    if page:
+        pages.append(page)
+    return tuple(pages)
+
+
+def city_token(city):
+    """
+    Identify a city in the callback data of the page buttons.
+    :param city: normalized city name
+    :return: the city itself, or a short hash if the name does not fit
+    """
+    if len(city.encode('utf-8')) <= MAX_CITY_TOKEN_LENGTH:
+        return city
+    return CITY_HASH_TOKEN_PREFIX + hashlib.sha1(city.encode('utf-8')).hexdigest()[:20]
+
+
+def city_page_keyboard(city, page, n_pages):
+    """
+    Build the prev/next buttons of a page of city results.
+    :param city: normalized city name
+    :param page: index of the page shown
+    :param n_pages: total number of pages
+    :return: the inline keyboard, None if there is nothing to navigate
+    """
+    token = city_token(city)
+    buttons = list()
+    if page > 0:
+        buttons.append(('⬅️', page - 1))
+    if page < n_pages - 1:
+        buttons.append(('➡️', page + 1))
+
+    buttons = [InlineKeyboardButton(text=f'{text} {target + 1}/{n_pages}',
+                                    callback_data=f'{CITY_PAGE_CALLBACK_PREFIX}{target}_{token}')
+               for (text, target) in buttons]
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup([buttons])
+
+
+class LineReply:
+    """
+    Pre-rendered reply to a search by line code. The subscriptions are not
+    part of it: they change on every toggle, on any worker.
+    """
+
+    __slots__ = ('code', 'text', 'timetable_url')
+
+    def __init__(self, line: dict):
+        self.code = line['code']
+        self.timetable_url = line['timetable_url']
+
+        cities = str.join('\n', map(lambda c: f' - {c}', line['cities']))
+        self.text = (f'👉 <b>{line["code"]}</b>\n'
+                     f'<b>Nome linea: </b>{line["name"]}\n\n'
+                     f'<b>Paesi: </b>\n{cities}\n\n')
+
+    def reply_markup(self, subscribed):
+        """
+        :param subscribed: whatever or not the chat receives the notifications of the line
+        """
+        if subscribed:
+            return get_disable_notifications_btn(self.code)
+        return get_enable_notifications_btn(self.code)
+
+
+def render_city(lines):
+    """
+    Render the pages of the reply to a search by city.
+    :param lines: dicts of the lines serving the city
+    :return: tuple of pages, empty if no line serves the city
+    """
+    lines = sorted(lines, key=lambda l: l['code'])
+    return paginate([strings.short_line_descr(l['code'], l['name'], l['timetable_url']) for l in lines])
+
+
+class ResponseCache:
+    """
+    Cache of the rendered replies, by line code and by city.
+
+    The scraper pushes the new lines through `reload` after each save, which
+    drops every reply and pre-renders the city ones. Entries also expire
+    after TTL seconds, to pick up changes saved by other processes, and are
+    evicted once expired. Misses (unknown codes and cities, as typed by the
+    users) are kept apart in LRU maps of at most MAX_MISSES entries.
+    """
+
+    TTL = 10 * 60
+    MAX_MISSES = 1000
+
+    def __init__(self, ttl=TTL, max_misses=MAX_MISSES):
+        self._ttl = ttl
+        self._max_misses = max_misses
+        self._lock = threading.Lock()
+        self._lines = dict()
+        self._cities = dict()
+        self._line_misses = OrderedDict()
+        self._city_misses = OrderedDict()
+        # hash token -> name of the cities too long for the callback data
+        self._city_tokens = dict()
+        self._next_eviction = time.monotonic() + ttl
+
+    def line(self, code, firestore):
+        """
+        :param code: code of the line
+        :param firestore: Firestore client, used on cache misses
+        :return: the LineReply, None if the line does not exist
+        """
+        reply = self._get(self._lines, self._line_misses, code)
+        if reply is not False:
+            return reply
+
+        doc = firestore.collection('lines').document(code).get()
+        reply = LineReply(doc.to_dict()) if doc.exists else None
+        # text that is not a line code is not worth remembering
+        self._put(self._lines, self._line_misses, code, reply, cache_miss=LINE_CODE_RE.fullmatch(code) is not None)
+        return reply
+
+    def city(self, city, firestore):
+        """
+        :param city: city name, normalized with normalize_city
+        :param firestore: Firestore client, used on cache misses
+        :return: tuple of pages, empty if no line serves the city
+        """
+        if not city:
+            return ()
+
+        pages = self._get(self._cities, self._city_misses, city)
+        if pages is not False:
+            return pages
+
+        # the scraper keeps a document with the lines serving each city
+        doc = firestore.collection('cities').document(city).get()
+        pages = render_city(doc.to_dict()['lines']) if doc.exists else ()
+        self._put(self._cities, self._city_misses, city, pages)
+        if pages:
+            self._remember_token(city)
+        return pages
+
+    def city_from_token(self, token):
+        """
+        :param token: token returned by city_token
+        :return: the city name, None if the token is a hash of a city unknown to this worker
+        """
+        if not token.startswith(CITY_HASH_TOKEN_PREFIX):
+            return token
+        with self._lock:
+            return self._city_tokens.get(token)
+
+    def _remember_token(self, city):
+        token = city_token(city)
+        if token != city:
+            with self._lock:
+                self._city_tokens[token] = city
+
+    def reload(self, lines: List[Line]):
+        """
+        Drop all the cached replies and pre-render the city ones.
+        :param lines: lines just saved by the scraper
+        """
+        by_city = dict()
+        for line in lines:
+            for city in line.cities:
+                by_city.setdefault(normalize_city(city), list()).append(
+                    {'code': line.code, 'name': line.name, 'timetable_url': line.url})
+
+        expires_at = time.monotonic() + self._ttl
+        cities = {city: (render_city(city_lines), expires_at) for city, city_lines in by_city.items()}
+
+        with self._lock:
+            self._lines = dict()
+            self._cities = cities
+            self._line_misses = OrderedDict()
+            self._city_misses = OrderedDict()
+            self._city_tokens = dict()
+        for city in cities:
+            self._remember_token(city)
+
+    def _get(self, entries, misses, key):
+        # False marks a miss, since None is a valid cached value
+        with self._lock:
+            entry = entries.get(key) or misses.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            return False
+        return entry[0]
+
+    def _put(self, entries, misses, key, value, cache_miss=True):
+        """
+        :param value: reply to cache, None or empty if the key is unknown
+        :param cache_miss: whatever or not an unknown key is cached
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_eviction:
+                self._evict(now)
+
+            if value:
+                entries[key] = (value, now + self._ttl)
+            elif cache_miss:
+                misses[key] = (value, now + self._ttl)
+                misses.move_to_end(key)
+                if len(misses) > self._max_misses:
+                    misses.popitem(last=False)
+
+    def _evict(self, now):
+        for entries in (self._lines, self._cities, self._line_misses, self._city_misses):
+            for key in [key for key, (_, expires_at) in entries.items() if expires_at < now]:
+                del entries[key]
+        self._next_eviction = now + self._ttl
+
+
+responses = ResponseCache()
@@ -0,0 +1,118 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionWriter:
+    """
+    Coalesce the notification toggles of the users.
+
+    A toggle only records the requested state of a (line, chat) pair; the
+    states are written `delay` seconds after the first pending toggle, in a
+    single batch. A user tapping enable/disable repeatedly costs one write,
+    with the last state.
+
+    :param delay: seconds a toggle waits for the next ones
+    """
+
+    DELAY = 2
+
+    def __init__(self, delay=DELAY):
+        self._delay = delay
+        self._lock = threading.Lock()
+        # (line code, chat id) -> subscribed
+        self._pending = dict()
+        self._firestore = None
+        self._timer = None
+
+    def set(self, code, chat_id, subscribed, firestore):
+        """
+        Request the subscription state of a chat to a line.
+        :param code: code of the line
+        :param chat_id: id of the chat
+        :param subscribed: true to enable the notifications, false to disable them
+        :param firestore: Firestore client used to write the state
+        """
+        with self._lock:
+            self._pending[(code, chat_id)] = subscribed
+            self._firestore = firestore
+            if self._timer is None:
+                self._timer = threading.Timer(self._delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def is_subscribed(self, code, chat_id, firestore):
+        """
+        Whatever or not a chat receives the notifications of a line, including
+        the toggles not written yet.
+        :param code: code of the line
+        :param chat_id: id of the chat
+        :param firestore: Firestore client
+        """
+        with self._lock:
+            pending = self._pending.get((code, chat_id))
+        if pending is not None:
+            return pending
+
+        # reads no field of the line, in particular not the whole user_subscriptions array
+        docs = firestore.collection(u'lines') \
+            .where(u'code', u'==', code) \
+            .where(u'user_subscriptions', u'array_contains', chat_id) \
+            .select([]) \
+            .limit(1) \
+            .stream()
+        return any(True for _ in docs)
+
+    def flush(self):
+        """
+        Write the pending states.
+        """
+        from utils import chunkify
+
+        with self._lock:
+            pending, self._pending = self._pending, dict()
+            firestore, self._timer = self._firestore, None
+
+        if not pending:
+            return
+
+        array_union, array_remove = self._transforms(firestore)
+        lines_ref = firestore.collection(u'lines')
+        for chunk in chunkify(list(pending.items()), 500):
+            updates = [(lines_ref.document(code), {u'user_subscriptions': (
+                array_union if subscribed else array_remove)([chat_id])})
+                for (code, chat_id), subscribed in chunk]
+
+            batch = firestore.batch()
+            for ref, data in updates:
+                batch.update(ref, data)
+            try:
+                batch.commit()
+            except Exception as e:
+                # e.g. a line deleted in the meantime: save the others one by one
+                logger.warning(f'Cannot save {len(chunk)} subscriptions at once: {e}')
+                for ref, data in updates:
+                    try:
+                        ref.update(data)
+                    except Exception as e:
+                        logger.error(f'Cannot save subscription to line {ref.id}: {e}')
+
+        logger.info(f'Saved {len(pending)} subscriptions')
+
+    @staticmethod
+    def _transforms(firestore):
+        """
+        :param firestore: Firestore client
+        :return: tuple (ArrayUnion, ArrayRemove) of the client, the firebase_admin ones
+                 unless the client brings its own (e.g. benchmarks.fakes.FakeFirestore)
+        """
+        if hasattr(firestore, 'ArrayUnion'):
+            return firestore.ArrayUnion, firestore.ArrayRemove
+
+        # imported here since only the toggles need it
+        from firebase_admin import firestore as firestore_api
+        return firestore_api.ArrayUnion, firestore_api.ArrayRemove
+
+
+subscriptions = SubscriptionWriter()
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from array import array
+
+from telegram import Update
+from telegram.ext import CallbackContext, DispatcherHandlerStop
+from telegram.ext.dispatcher import run_async
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# counter of the updates dropped by the throttle
+THROTTLED_UPDATES = 'throttled_updates'
+
+
+class TokenBuckets:
+    """
+    Per-chat token buckets.
+
+    Buckets are slots of two arrays of doubles (tokens and time of the last
+    refill) indexed through a chat id -> slot dictionary. Buckets idle for
+    `idle_ttl` seconds are full again, so they are evicted and their slots reused.
+
+    :param rate: tokens added to a bucket every second
+    :param burst: capacity of a bucket
+    :param idle_ttl: seconds after which an idle bucket is evicted
+    """
+
+    def __init__(self, rate, burst, idle_ttl=10 * 60):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+
+        self._lock = threading.Lock()
+        self._slots = dict()
+        self._free = list()
+        self._tokens = array('d')
+        self._updated_at = array('d')
+        self._next_eviction = time.monotonic() + idle_ttl
+
+    def __len__(self):
+        return len(self._slots)
+
+    def consume(self, chat_id, now=None):
+        """
+        Take a token from the bucket of a chat.
+        :param chat_id: id of the chat
+        :param now: current time.monotonic(), for testing
+        :return: true if a token was available
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if now >= self._next_eviction:
+                self._evict(now)
+
+            slot = self._slots.get(chat_id)
+            if slot is None:
+                slot = self._allocate(chat_id)
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, self._tokens[slot] + (now - self._updated_at[slot]) * self.rate)
+
+            allowed = tokens >= 1
+            self._tokens[slot] = tokens - 1 if allowed else tokens
+            self._updated_at[slot] = now
+            return allowed
+
+    def _allocate(self, chat_id):
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._tokens)
+            self._tokens.append(0)
+            self._updated_at.append(0)
+        self._slots[chat_id] = slot
+        return slot
+
+    def _evict(self, now):
+        idle = [chat_id for chat_id, slot in self._slots.items() if now - self._updated_at[slot] >= self.idle_ttl]
+        for chat_id in idle:
+            self._free.append(self._slots.pop(chat_id))
+        self._next_eviction = now + self.idle_ttl
+        logger.debug(f'Evicted {len(idle)} idle buckets, {len(self._slots)} left')
+
+
+@run_async
+def _answer_throttled(bot, callback_query_id):
+    # on the worker pool: the throttle runs on the dispatcher thread
+    bot.answer_callback_query(callback_query_id, text='Troppe richieste, riprova tra poco')
+
+
+class UpdateThrottle:
+    """
+    Drop the updates of chats exceeding their rate.
+
+    Registered as a TypeHandler in a group preceding the other handlers: the
+    update of a throttled chat raises DispatcherHandlerStop, so no other
+    handler runs. The callback queries of a throttled chat are answered (to
+    stop the client spinner) on the worker pool, at most once in the time its
+    bucket takes to fill up again.
+
+    :param rate: updates per second allowed to a chat
+    :param burst: updates a chat can send at once
+    """
+
+    # default rate and burst of every chat
+    RATE = 1
+    BURST = 5
+
+    def __init__(self, rate=RATE, burst=BURST):
+        self.buckets = TokenBuckets(rate, burst)
+        # a single answer every burst / rate seconds
+        self.answers = TokenBuckets(rate / burst, 1)
+
+    def __call__(self, update: Update, context: CallbackContext):
+        chat = update.effective_chat
+        if chat is None or self.buckets.consume(chat.id):
+            return
+
+        metrics.count(THROTTLED_UPDATES)
+        if update.callback_query and self.answers.consume(chat.id):
+            _answer_throttled(context.bot, update.callback_query.id)
+        raise DispatcherHandlerStop()
@@ -0,0 +1,103 @@
+import threading
+import time
+from typing import List
+
+from line import Line, normalize_city
+from timetable import Timetable
+
+
+class TimetableIndex:
+    """
+    Cache of the timetables extracted by the scraper, and of the lines
+    serving each city (read from the `cities` collection).
+
+    A timetable is read from Firestore once per `file_hash`: `reload` drops
+    the timetables whose pdf changed and rebuilds the city index from the
+    lines just saved by the scraper.
+    """
+
+    # seconds after which the lines of a city are read again from Firestore
+    TTL = 10 * 60
+
+    def __init__(self, ttl=TTL):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # city -> (((code, file_hash), ...), expiration)
+        self._cities = dict()
+        # code -> (file_hash, Timetable), the timetable is None if it was not extracted
+        self._timetables = dict()
+
+    def next_departures(self, city, minute, weekday, firestore, count=3):
+        """
+        Find the next departures from the stops of a city.
+        :param city: city name, normalized with `line.normalize_city`
+        :param minute: minutes after midnight
+        :param weekday: day of the week (0 is monday)
+        :param firestore: Firestore client, used on cache misses
+        :param count: maximum number of departures per stop
+        :return: list of (line code, stop name, [minutes]), sorted by first departure
+        """
+        result = list()
+        for code, file_hash in self._lines(city, firestore):
+            timetable = self._timetable(code, file_hash, firestore)
+            if timetable is None:
+                continue
+            for stop, departures in timetable.next_departures(city, minute, weekday, count):
+                result.append((code, stop, departures))
+
+        result.sort(key=lambda departure: departure[2][0])
+        return result
+
+    def reload(self, lines: List[Line]):
+        """
+        Rebuild the city index and drop the outdated timetables.
+        :param lines: lines just saved by the scraper
+        """
+        expires_at = time.monotonic() + self._ttl
+        by_city = dict()
+        hashes = dict()
+        for line in lines:
+            hashes[line.code] = line.file_hash
+            for city in line.cities:
+                by_city.setdefault(normalize_city(city), list()).append((line.code, line.file_hash))
+
+        with self._lock:
+            self._cities = {city: (tuple(codes), expires_at) for city, codes in by_city.items()}
+            # missing timetables are looked up again, they may have been extracted in this session
+            self._timetables = {code: entry for code, entry in self._timetables.items()
+                                if entry[1] is not None and hashes.get(code) == entry[0]}
+
+    def _lines(self, city, firestore):
+        if not city:
+            return ()
+
+        with self._lock:
+            entry = self._cities.get(city)
+        if entry is not None and entry[1] >= time.monotonic():
+            return entry[0]
+
+        # a single read, which does not load the subscriptions of the lines
+        doc = firestore.collection(u'cities').document(city).get()
+        lines = tuple((line['code'], line.get('file_hash')) for line in doc.to_dict()['lines']) if doc.exists else ()
+        with self._lock:
+            self._cities[city] = (lines, time.monotonic() + self._ttl)
+        return lines
+
+    def _timetable(self, code, file_hash, firestore):
+        with self._lock:
+            entry = self._timetables.get(code)
+        if entry is not None and entry[0] == file_hash:
+            return entry[1]
+
+        doc = firestore.collection(u'timetables').document(code).get()
+        timetable = Timetable.from_dict(doc.to_dict()) if doc.exists else None
+        if timetable is not None and timetable.file_hash != file_hash:
+            # the scraper has not extracted the new pdf yet
+            timetable = None
+
+        with self._lock:
+            self._timetables[code] = (file_hash, timetable)
+        return timetable
+
+
+timetables = TimetableIndex()
@@ -0,0 +1,115 @@
+import os
+
+
+class Config:
+    """
+    Settings read from the environment.
+
+    Values are read when first accessed, so that a process only needs the
+    variables of the subsystems it actually runs (e.g. a scrape-only process
+    does not need TELEGRAM_TOKEN).
+    """
+
+    def __init__(self, environ=os.environ):
+        self._environ = environ
+
+    def _required(self, name):
+        if name not in self._environ:
+            raise ValueError(f"Environment variable '{name}' required")
+        return self._environ[name]
+
+    def _optional(self, name, default=None, cast=str):
+        value = self._environ.get(name, None)
+        return cast(value) if value is not None else default
+
+    # credentials
+
+    @property
+    def telegram_token(self):
+        return self._required('TELEGRAM_TOKEN')
+
+    @property
+    def bitly_access_token(self):
+        return self._required('BITLY_ACCESS_TOKEN')
+
+    @property
+    def locationiq_api_key(self):
+        return self._required('LOCATIONIQ_API_KEY')
+
+    @property
+    def google_credentials_file(self):
+        return self._required('GOOGLE_CREDENTIALS_FILE')
+
+    # bot
+
+    @property
+    def bot_workers(self):
+        """
+        number of dispatcher worker threads (None for the library default)
+        """
+        return self._optional('BOT_WORKERS', cast=int)
+
+    @property
+    def webhook_url(self):
+        """
+        when set, updates are received through a webhook instead of long polling
+        """
+        return self._optional('WEBHOOK_URL')
+
+    @property
+    def webhook_listen(self):
+        return self._optional('WEBHOOK_LISTEN', '127.0.0.1')
+
+    @property
+    def webhook_port(self):
+        return self._optional('WEBHOOK_PORT', 8443, int)
+
+    @property
+    def webhook_path(self):
+        return self._optional('WEBHOOK_PATH') or self.telegram_token
+
+    @property
+    def metrics_log_interval(self):
+        """
+        seconds between two metrics summaries written to the log
+        """
+        return self._optional('METRICS_LOG_INTERVAL', 15 * 60, int)
+
+    @property
+    def metrics_port(self):
+        """
+        when set, metrics are also served over HTTP on localhost
+        """
+        return self._optional('METRICS_PORT', cast=int)
+
+    # scraper
+
+    @property
+    def scraper_executor(self):
+        """
+        where timetables are hashed and parsed: 'process' or 'thread' pool
+        """
+        return self._optional('SCRAPER_EXECUTOR', 'process')
+
+    @property
+    def scraper_workers(self):
+        """
+        number of workers of the scraper pool (None for one per core)
+        """
+        return self._optional('SCRAPER_WORKERS', cast=int)
+
+    # events
+
+    @property
+    def events_backend(self):
+        """
+        where the scraper events and the outgoing notifications are stored: 'firestore' or 'sqlite'
+        """
+        return self._optional('EVENTS_BACKEND', 'firestore')
+
+    @property
+    def events_sqlite_path(self):
+        return self._optional('EVENTS_SQLITE_PATH', 'events.sqlite3')
+
+
+config = Config()
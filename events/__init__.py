@@ -0,0 +1,4 @@
+from .base import Event, EventQueue, LINES_DELETED, LINES_FILE_CHANGED, LINES_SAVED, SESSION_SAVED
+from .consumer import EventConsumer
+from .firestore import FirestoreEventQueue
+from .sqlite import SqliteEventQueue
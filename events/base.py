@@ -0,0 +1,85 @@
+import hashlib
+import json
+import time
+
+# kinds of events published by the scraper
+LINES_DELETED = 'lines_deleted'
+LINES_FILE_CHANGED = 'lines_file_changed'
+LINES_SAVED = 'lines_saved'
+SESSION_SAVED = 'session_saved'
+
+
+def event_id(kind, payload, session=None):
+    """
+    Deterministic id of an event: publishing the same event twice in a session
+    stores it only once. The session is part of the id since the same payload
+    (e.g. the old state of a line) can come back in a later session.
+    :param kind: kind of the event
+    :param payload: json-serializable payload
+    :param session: id of the scraper session publishing the event
+    :return: the id of the event
+    """
+    digest = hashlib.sha256(json.dumps([session, payload], sort_keys=True, default=str).encode('utf-8'))
+    return f'{kind}-{digest.hexdigest()[:32]}'
+
+
+class Event:
+    """
+    A change published by the scraper.
+    """
+
+    __slots__ = ('id', 'kind', 'payload', 'created')
+
+    def __init__(self, id, kind, payload, created=None):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.created = created if created is not None else time.time()
+
+    def __repr__(self):
+        return f"Event({self.id})"
+
+
+class EventQueue:
+    """
+    Durable, append-only channel between the scraper and the bot workers.
+    Every consumer reads all the events (see `read`).
+    """
+
+    def publish(self, kind, payload, session=None):
+        """
+        Append an event, unless an identical one was already published in the same session.
+        :param kind: kind of the event
+        :param payload: json-serializable payload
+        :param session: id of the scraper session publishing the event
+        :return: the event
+        """
+        event = Event(event_id(kind, payload, session), kind, payload)
+        self._append(event)
+        return event
+
+    def get(self, event_id):
+        """
+        :param event_id: id of the event
+        :return: the event, None if it does not exist
+        """
+        raise NotImplementedError
+
+    def cursor_since(self, timestamp):
+        """
+        :param timestamp: unix time
+        :return: a cursor pointing to the first event created after timestamp
+        """
+        raise NotImplementedError
+
+    def read(self, cursor, limit=100):
+        """
+        Read the events following the cursor, oldest first.
+        :param cursor: cursor returned by cursor_since or by a previous read
+        :param limit: maximum number of events returned
+        :return: list of events and the cursor to continue from
+        """
+        raise NotImplementedError
+
+    def _append(self, event: Event):
+        raise NotImplementedError
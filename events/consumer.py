@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from .base import EventQueue
+
+logger = logging.getLogger(__name__)
+
+
+class EventConsumer:
+    """
+    Poll an event queue on a background thread and dispatch the events.
+
+    Handlers run on every consumer (e.g. cache refreshes). They receive the
+    event and must be idempotent, since a restarted consumer replays the
+    events of the last `replay_window` seconds. A handler raising an
+    exception is called again with the same event, after a backoff.
+
+    :param queue: event queue
+    :param poll_interval: seconds between two reads of the queue
+    :param replay_window: seconds of past events read at start-up
+    """
+
+    def __init__(self, queue: EventQueue, poll_interval=5, replay_window=24 * 60 * 60):
+        self._queue = queue
+        self._poll_interval = poll_interval
+        self._replay_window = replay_window
+        self._broadcast = dict()
+        # (callback, event, attempts, time.monotonic() of the next attempt) of the failed handlers
+        self._failed = list()
+        # ids of the events to dispatch again, see resume
+        self._resumed = deque()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_broadcast_handler(self, kind, callback):
+        self._broadcast.setdefault(kind, list()).append(callback)
+
+    def resume(self, event_id):
+        """
+        Dispatch an event again on the consumer thread, e.g. an event whose
+        handling was interrupted on another worker.
+        :param event_id: id of the event
+        """
+        self._resumed.append(event_id)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='event-consumer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        cursor = self._queue.cursor_since(time.time() - self._replay_window)
+
+        while not self._stop_event.is_set():
+            self._retry()
+
+            try:
+                events, cursor = self._queue.read(cursor)
+            except Exception as e:
+                logger.error(f'Cannot read events: {e}')
+                events = list()
+
+            for event in events:
+                self._dispatch(event)
+
+            if not events:
+                self._stop_event.wait(self._poll_interval)
+
+    def _dispatch(self, event):
+        for callback in self._broadcast.get(event.kind, ()):
+            self._call(callback, event)
+
+    def _retry(self):
+        while self._resumed:
+            event_id = self._resumed.popleft()
+            try:
+                event = self._queue.get(event_id)
+            except Exception as e:
+                logger.error(f'Cannot read event {event_id}: {e}')
+                self._resumed.append(event_id)
+                return
+            if event is not None:
+                logger.info(f'Resuming {event}')
+                self._dispatch(event)
+
+        now = time.monotonic()
+        failed, self._failed = self._failed, list()
+        for callback, event, attempts, retry_at in failed:
+            if retry_at > now:
+                self._failed.append((callback, event, attempts, retry_at))
+            else:
+                self._call(callback, event, attempts)
+
+    def _call(self, callback, event, attempts=0):
+        try:
+            callback(event)
+        except Exception as e:
+            attempts += 1
+            logger.error(f'Error handling {event} (attempt {attempts}): {e}')
+            self._failed.append((callback, event, attempts, time.monotonic() + min(2 ** attempts, 15 * 60)))
@@ -0,0 +1,58 @@
+from .base import EventQueue, Event
+
+
+class FirestoreEventQueue(EventQueue):
+    """
+    Event queue stored in the `events` Firestore collection.
+    Each event is a document whose id is the event id. Events are read in
+    (created, id) order, so that events created at the same time are not skipped.
+
+    :param firestore_client: Firestore client
+    """
+
+    EVENTS_COLLECTION = u'events'
+    # field path of the document id, used to order the events created at the same time
+    DOCUMENT_ID = u'__name__'
+
+    def __init__(self, firestore_client):
+        self.fs = firestore_client
+
+    def _get_events_collection(self):
+        return self.fs.collection(self.EVENTS_COLLECTION)
+
+    def _append(self, event: Event):
+        # create() fails if the document exists, which makes publishing idempotent
+        from google.api_core.exceptions import Conflict
+
+        try:
+            self._get_events_collection().document(event.id).create({
+                u'kind': event.kind,
+                u'payload': event.payload,
+                u'created': event.created,
+            })
+        except Conflict:
+            pass
+
+    def get(self, event_id):
+        doc = self._get_events_collection().document(event_id).get()
+        if not doc.exists:
+            return None
+        d = doc.to_dict()
+        return Event(doc.id, d['kind'], d['payload'], d['created'])
+
+    def cursor_since(self, timestamp):
+        # (created, id) of the last event read, no id before the first read
+        return timestamp, None
+
+    def read(self, cursor, limit=100):
+        created, last_id = cursor
+        query = self._get_events_collection()
+        if last_id is None:
+            query = query.where(u'created', u'>', created)
+        query = query.order_by(u'created').order_by(self.DOCUMENT_ID)
+        if last_id is not None:
+            query = query.start_after([created, last_id])
+
+        events = [Event(doc.id, d['kind'], d['payload'], d['created']) for doc, d in
+                  ((doc, doc.to_dict()) for doc in query.limit(limit).stream())]
+        return events, (events[-1].created, events[-1].id) if events else cursor
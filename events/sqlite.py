@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import threading
+
+from .base import EventQueue, Event
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_created ON events (created);
+'''
+
+
+class SqliteEventQueue(EventQueue):
+    """
+    Event queue stored in a local SQLite database, shared by the processes
+    running on the same host.
+
+    :param path: path of the database file
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.executescript(_SCHEMA)
+
+    def _connection(self):
+        # sqlite connections cannot be shared among threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self._path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def _append(self, event: Event):
+        with self._connection() as db:
+            db.execute('INSERT OR IGNORE INTO events (id, kind, payload, created) VALUES (?, ?, ?, ?)',
+                       (event.id, event.kind, json.dumps(event.payload, default=str), event.created))
+
+    def get(self, event_id):
+        row = self._connection().execute('SELECT id, kind, payload, created FROM events WHERE id = ?',
+                                         (event_id,)).fetchone()
+        return Event(row[0], row[1], json.loads(row[2]), row[3]) if row else None
+
+    def cursor_since(self, timestamp):
+        row = self._connection().execute('SELECT MIN(seq) FROM events WHERE created > ?', (timestamp,)).fetchone()
+        if row[0] is not None:
+            return row[0] - 1
+        row = self._connection().execute('SELECT MAX(seq) FROM events').fetchone()
+        return row[0] or 0
+
+    def read(self, cursor, limit=100):
+        rows = self._connection().execute(
+            'SELECT seq, id, kind, payload, created FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+            (cursor, limit)).fetchall()
+        events = [Event(id, kind, json.loads(payload), created) for (_, id, kind, payload, created) in rows]
+        return events, rows[-1][0] if rows else cursor
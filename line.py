@@ -1,32 +1,60 @@
+def normalize_city(name: str):
+    """
+    Normalize a city name as typed by users or scraped from the website.
+    The result is also the id of the city document, so it contains no slashes.
+    :param name: name of the city
+    :return: upper case name, with single spaces
+    """
+    return ' '.join(name.replace('/', ' ').split()).upper()
+
+
 class Line:
     """
     This class models a bus line.
+
+    Lines are built in bulk and kept in memory by the bot caches, so instances
+    use __slots__ and cities are stored in a tuple. The ids of the subscribed
+    chats are kept in the list decoded from Firestore, without copying nor
+    converting them (Firestore ArrayUnion already keeps them unique).
     """
 
-    def __init__(self, code: str, name: str, url: str):
+    __slots__ = ('code', 'name', 'url', 'cities', 'file_hash', '_user_subscriptions')
+
+    def __init__(self, code: str, name: str, url: str, cities=(), file_hash=None, user_subscriptions=()):
         """Constructor
 
         :param code: code of the line
         :param name: canonical name of the line
         :param url: url to the pdf file of the timetable
+        :param cities: names of the cities served by the line
+        :param file_hash: sha256 hash of the timetable
+        :param user_subscriptions: ids of the chats subscribed to changes in this line
         """
         self.code = code
         self.name = name
         self.url = url
-        self.cities = list()
-        self.file_hash = None
+        self.cities = tuple(cities)
+        self.file_hash = file_hash
+        self.user_subscriptions = user_subscriptions
+
+    @property
+    def user_subscriptions(self):
+        """
+        List of ids of chats subscribed to changes in this line
+        """
+        return self._user_subscriptions
 
-        # list of ids of chats subscribed to changes in this line
-        self.user_subscriptions = list()
+    @user_subscriptions.setter
+    def user_subscriptions(self, chats):
+        # a decoded list is kept as it is, only other iterables are copied
+        self._user_subscriptions = chats if isinstance(chats, list) else list(chats)
 
     @staticmethod
     def from_dict(source: dict):
-        line = Line(source['code'], source['name'], source['timetable_url'])
-        line.cities = list(source['cities'])
-        line.file_hash = source['file_hash']
-        if 'user_subscriptions' in source:
-            line.user_subscriptions = list(source['user_subscriptions'])
-        return line
+        return Line(source['code'], source['name'], source['timetable_url'],
+                    cities=source['cities'],
+                    file_hash=source['file_hash'],
+                    user_subscriptions=source.get('user_subscriptions', ()))
 
     def to_dict(self):
         return {
@@ -35,7 +63,7 @@ class Line:
             u'timetable_url': self.url,
             u'cities': list(self.cities),
             u'file_hash': self.file_hash,
-            u'user_subscriptions': list(self.user_subscriptions),
+            u'user_subscriptions': list(self._user_subscriptions),
         }
 
     def __eq__(self, other):
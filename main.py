@@ -1,85 +1,188 @@
+import argparse
 import asyncio
 import datetime
 import logging
-import os
 from logging.handlers import TimedRotatingFileHandler
-from typing import List
 
-from firebase_admin import firestore
-from telegram import ParseMode
-
-from bot import GrandaBusBot
-from bot.firestore_persistence import FirestorePersistence
+from config import config
 from line import Line
-from scraper import GrandaBusScraper
-from utils.firebase_utils import init_firebase
 
-if 'TELEGRAM_TOKEN' not in os.environ:
-    raise ValueError("Environment variable 'TELEGRAM_TOKEN' required")
+# Heavy subsystems (firebase_admin/grpc, telegram, aiohttp, bs4) are imported
+# inside the functions that build them, so nothing is loaded at import time.
 
-TELEGRAM_TOKEN = os.environ['TELEGRAM_TOKEN']
+logger = logging.getLogger(__name__)
 
-init_firebase()
-fs = firestore.client()
 
-bot = GrandaBusBot(TELEGRAM_TOKEN, use_context=True, persistence=FirestorePersistence(fs))
+def get_firestore():
+    from firebase_admin import firestore
+    from utils.firebase_utils import init_firebase
 
-scraper = GrandaBusScraper(fs)
+    init_firebase()
+    return firestore.client()
 
 
-def on_lines_deleted(lines: List[Line]):
+def get_event_queue(fs):
     """
-    Notify bot's users of deleted lines
-    :param lines: deleted lines
+    Build the channel between the scraper and the bot workers.
+    :param fs: Firestore client
     """
-    for line in lines:
-        for chat in line.user_subscriptions:
-            bot.send_queued_message(chat_id=chat, text=f"⚠️⚠️⚠️\nLa linea {line.code} ({line.name}) è stata eliminata.",
-                                    queued=True, parse_mode=ParseMode.MARKDOWN)
+    from events import FirestoreEventQueue, SqliteEventQueue
+
+    if config.events_backend == 'sqlite':
+        return SqliteEventQueue(config.events_sqlite_path)
+    return FirestoreEventQueue(fs)
 
 
-def on_lines_file_changed(lines: List[Line]):
+def get_outbox(fs):
     """
-    Notify bot's users of changed lines
-    :param lines: updated line
+    Build the persistent queue of the outgoing notifications.
+    :param fs: Firestore client
     """
-    for line in lines:
-        for chat in line.user_subscriptions:
-            bot.send_queued_message(chat_id=chat,
-                                    text=f"⚠️⚠️⚠️\nLa linea {line.code} ({line.name}) è stata aggiornata.",
-                                    queued=True, parse_mode=ParseMode.MARKDOWN)
-            bot.send_queued_document(chat_id=chat, document=line.url, queued=True)
+    from bot.outbox import FirestoreOutbox, SqliteOutbox
+
+    if config.events_backend == 'sqlite':
+        return SqliteOutbox(config.events_sqlite_path)
+    return FirestoreOutbox(fs)
+
 
+def build_bot(fs):
+    from bot import GrandaBusBot
+    from bot.firestore_persistence import FirestorePersistence
 
-async def scrape_every_day():
-    await scraper.run()
+    return GrandaBusBot(config.telegram_token, use_context=True,
+                        workers=config.bot_workers or GrandaBusBot.DEFAULT_WORKERS,
+                        persistence=FirestorePersistence(fs))
 
-    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-    tomorrow_with_time = datetime.datetime(
-        year=tomorrow.year,
-        month=tomorrow.month,
-        day=tomorrow.day,
-        minute=0,
-        second=0,
-        microsecond=0
-    )
-    loop.call_at(tomorrow_with_time.timestamp(), scrape_every_day)
 
+def build_scraper(fs, queue):
+    """
+    Build a scraper publishing its changes on the event queue.
+    :param fs: Firestore client
+    :param queue: event queue
+    """
+    from events import LINES_DELETED, LINES_FILE_CHANGED, LINES_SAVED, SESSION_SAVED
+    from scraper import GrandaBusScraper
+
+    def publish_lines(kind):
+        # the session is part of the event ids: the same lines can be deleted or changed again later
+        return lambda lines: queue.publish(kind, [line.to_dict() for line in sorted(lines, key=lambda l: l.code)],
+                                           session=scraper.session)
 
-async def main():
-    bot.run()  # non blocking
+    scraper = GrandaBusScraper(fs, do_not_overwrite_if_unchanged=False)
+    scraper.on_lines_deleted = publish_lines(LINES_DELETED)
+    scraper.on_lines_file_changed = publish_lines(LINES_FILE_CHANGED)
+    scraper.on_lines_saved = publish_lines(LINES_SAVED)
+    scraper.on_session_saved = lambda date: queue.publish(SESSION_SAVED, {u'date': date.timestamp()},
+                                                          session=scraper.session)
+    return scraper
+
+
+def build_event_consumer(queue, outbox):
+    """
+    Apply the scraper events to a bot worker.
+    :param queue: event queue
+    :param outbox: outbox of the notifications
+    """
+    from bot.cache import last_session
+    from bot.inline import inline_results
+    from bot.notifications import lines_deleted_messages, lines_file_changed_messages
+    from bot.rendering import responses
+    from bot.timetables import timetables
+    from events import EventConsumer, LINES_DELETED, LINES_FILE_CHANGED, LINES_SAVED, SESSION_SAVED
+
+    def lines(event):
+        return [Line.from_dict(line) for line in event.payload]
+
+    consumer = EventConsumer(queue)
+    # every worker keeps its own caches
+    consumer.add_broadcast_handler(
+        SESSION_SAVED, lambda event: last_session.set(datetime.datetime.fromtimestamp(event.payload['date'])))
+    consumer.add_broadcast_handler(LINES_SAVED, lambda event: responses.reload(lines(event)))
+    consumer.add_broadcast_handler(LINES_SAVED, lambda event: timetables.reload(lines(event)))
+    consumer.add_broadcast_handler(LINES_SAVED, lambda event: inline_results.reload(lines(event)))
+    # only the worker claiming the event enqueues its notifications
+    consumer.add_broadcast_handler(
+        LINES_DELETED, lambda event: outbox.fan_out(event.id, lines_deleted_messages(event.id, lines(event))))
+    consumer.add_broadcast_handler(
+        LINES_FILE_CHANGED, lambda event: outbox.fan_out(event.id, lines_file_changed_messages(event.id, lines(event))))
+    return consumer
+
+
+def start_bot(fs, queue):
+    """
+    Start the bot, its event consumer and its notifications sender (non blocking).
+    :return: the bot
+    """
+    from bot.inline import inline_results
+    from bot.metrics import metrics
+    from bot.outbox import OutboxSender
 
-    scraper.do_not_overwrite_if_unchanged = False
-    scraper.on_lines_deleted = on_lines_deleted
-    scraper.on_lines_file_changed = on_lines_file_changed
+    bot = build_bot(fs)
+    # inline queries are answered from memory: load the lines saved before the bot started
+    inline_results.reload([Line.from_dict(doc.to_dict()) for doc in fs.collection(u'lines').stream()])
 
-    await scrape_every_day()
+    if config.webhook_url:
+        bot.run_webhook(listen=config.webhook_listen, port=config.webhook_port,
+                        url_path=config.webhook_path, webhook_url=config.webhook_url)
+    else:
+        bot.run()
+
+    bot.job_queue.run_repeating(metrics.log_summary, interval=config.metrics_log_interval)
+    if config.metrics_port:
+        metrics.serve(config.metrics_port)
+
+    outbox = get_outbox(fs)
+    consumer = build_event_consumer(queue, outbox)
+    consumer.start()
+    # fan-outs interrupted by a crash are dispatched again once their lease expired
+    OutboxSender(bot, outbox, resume_fan_out=consumer.resume).start()
+    return bot
+
+
+async def scrape_every_day(scraper):
+    while True:
+        try:
+            await scraper.run()
+        except Exception as e:
+            logger.error(f'Scraper session failed: {e}')
+
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        tomorrow_with_time = datetime.datetime(
+            year=tomorrow.year,
+            month=tomorrow.month,
+            day=tomorrow.day,
+            minute=0,
+            second=0,
+            microsecond=0
+        )
+        await asyncio.sleep((tomorrow_with_time - datetime.datetime.now()).total_seconds())
+
+
+def run_scraper():
+    fs = get_firestore()
+    asyncio.get_event_loop().run_until_complete(scrape_every_day(build_scraper(fs, get_event_queue(fs))))
+
+
+def run_bot():
+    fs = get_firestore()
+    start_bot(fs, get_event_queue(fs)).idle()
+
+
+def run_all():
+    fs = get_firestore()
+    queue = get_event_queue(fs)
+    start_bot(fs, queue)
+    asyncio.get_event_loop().run_until_complete(scrape_every_day(build_scraper(fs, queue)))
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GrandaBus Unofficial Bot')
+    parser.add_argument('process', nargs='?', choices=('all', 'bot', 'scrape'), default='all',
+                        help='run both the bot and the scraper (default), or only one of them')
+    args = parser.parse_args()
+
     handler = TimedRotatingFileHandler("logs.log", when="midnight", interval=1)
     handler.suffix = "%Y%m%d"
     logging.basicConfig(level=logging.INFO, handlers=[handler])
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    {'all': run_all, 'bot': run_bot, 'scrape': run_scraper}[args.process]()
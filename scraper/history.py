@@ -0,0 +1,169 @@
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from line import Line
+from utils import chunkify
+
+logger = logging.getLogger(__name__)
+
+# fields of a line whose changes are recorded
+TRACKED_FIELDS = (u'name', u'timetable_url', u'cities', u'file_hash')
+
+
+class LineChange:
+    """
+    A change of a line observed by a scraper session: only the fields that
+    changed, with their new value. A line seen for the first time has all
+    the fields, a deleted line none.
+    """
+
+    __slots__ = ('code', 'date', 'changes', 'deleted')
+
+    def __init__(self, code, date: datetime, changes: dict, deleted=False):
+        self.code = code
+        self.date = date
+        self.changes = changes
+        self.deleted = deleted
+
+    @property
+    def id(self):
+        # deterministic, so that recording a session twice does not duplicate it
+        return f'{self.code}@{self.date:%Y%m%dT%H%M%S}'
+
+    @staticmethod
+    def from_dict(source: dict):
+        return LineChange(source['code'], source['date'], source.get('changes', dict()),
+                          source.get('deleted', False))
+
+    def to_dict(self):
+        return {
+            u'code': self.code,
+            u'date': self.date,
+            u'changes': self.changes,
+            u'deleted': self.deleted,
+        }
+
+    def __repr__(self):
+        return f"LineChange({self.id}, {sorted(self.changes) if not self.deleted else 'deleted'})"
+
+
+def diff(old: Line, new: Line):
+    """
+    :param old: stored state of the line, None if the line is new
+    :param new: scraped state of the line
+    :return: the changed fields with their new value
+    """
+    # the tracked fields are read directly: to_dict would also copy the subscriptions
+    new_fields = _tracked_fields(new)
+    old_fields = _tracked_fields(old) if old is not None else dict()
+    return {field: new_fields[field] for field in TRACKED_FIELDS
+            if field not in old_fields or old_fields[field] != new_fields[field]}
+
+
+def _tracked_fields(line: Line):
+    return {
+        u'name': line.name,
+        u'timetable_url': line.url,
+        u'cities': list(line.cities),
+        u'file_hash': line.file_hash,
+    }
+
+
+class LineHistory:
+    """
+    History of the lines stored as deltas in the `line_history` collection,
+    one document per line and session in which the line changed: storage
+    grows with the changes, not with the sessions.
+
+    Documents are indexed by `code` and `date`; the queries by code need a
+    composite index on (code, date).
+
+    :param firestore_client: Firestore client
+    """
+
+    HISTORY_COLLECTION = u'line_history'
+    BATCH_MAXIMUM_SIZE = 500
+
+    def __init__(self, firestore_client):
+        self.fs = firestore_client
+
+    def _get_history_collection(self):
+        return self.fs.collection(self.HISTORY_COLLECTION)
+
+    def record(self, old_lines: Dict[str, Line], lines: List[Line], date: datetime, unshortened=()):
+        """
+        Record the changes between the stored lines and the ones just scraped.
+        :param old_lines: lines stored before the session, by code
+        :param lines: lines scraped
+        :param date: date of the session
+        :param unshortened: codes of the lines whose url could not be shortened in this session:
+                            their long url is not a change of the timetable url
+        :return: the changes recorded
+        """
+        changes = list()
+        for line in lines:
+            old_line = old_lines.get(line.code)
+            fields = diff(old_line, line)
+            if old_line is not None and line.code in unshortened:
+                fields.pop(u'timetable_url', None)
+            if fields:
+                changes.append(LineChange(line.code, date, fields))
+
+        scraped = {line.code for line in lines}
+        changes.extend(LineChange(code, date, dict(), deleted=True) for code in old_lines if code not in scraped)
+
+        collection = self._get_history_collection()
+        for chunk in chunkify(changes, self.BATCH_MAXIMUM_SIZE):
+            batch = self.fs.batch()
+            for change in chunk:
+                batch.set(collection.document(change.id), change.to_dict())
+            batch.commit()
+
+        logger.info(f'Recorded {len(changes)} line changes')
+        return changes
+
+    def changes_since(self, since: datetime) -> List[LineChange]:
+        """
+        :param since: start date
+        :return: changes of all the lines recorded since the given date, oldest first
+        """
+        docs = self._get_history_collection() \
+            .where(u'date', u'>=', since) \
+            .order_by(u'date') \
+            .stream()
+        return [LineChange.from_dict(doc.to_dict()) for doc in docs]
+
+    def last_change(self, code) -> LineChange:
+        """
+        :param code: code of the line
+        :return: the latest change of the line, None if the line was never recorded
+        """
+        docs = self._get_history_collection() \
+            .where(u'code', u'==', code) \
+            .order_by(u'date', direction=u'DESCENDING') \
+            .limit(1) \
+            .stream()
+        return next((LineChange.from_dict(doc.to_dict()) for doc in docs), None)
+
+    def line_at(self, code, date: datetime):
+        """
+        Rebuild the state of a line by applying its changes up to a date.
+        :param code: code of the line
+        :param date: date of the state
+        :return: the fields of the line, None if the line did not exist
+        """
+        docs = self._get_history_collection() \
+            .where(u'code', u'==', code) \
+            .where(u'date', u'<=', date) \
+            .order_by(u'date') \
+            .stream()
+
+        fields = None
+        for doc in docs:
+            change = LineChange.from_dict(doc.to_dict())
+            if change.deleted:
+                fields = None
+            else:
+                fields = dict(fields or {u'code': code}, **change.changes)
+        return fields
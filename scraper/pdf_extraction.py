@@ -0,0 +1,63 @@
+import functools
+import io
+import logging
+
+from timetable import Timetable, parse_days, parse_time
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _pdfplumber():
+    try:
+        # optional dependency, not in requirements.txt: only needed by the scraper
+        import pdfplumber
+        return pdfplumber
+    except ImportError:
+        logger.warning('pdfplumber is not installed, timetables are not extracted')
+        return None
+
+
+def extract_timetable(payload: bytes, file_hash):
+    """
+    Extract the timetable printed in a pdf.
+
+    Every table row starting with a stop name followed by at least one time is
+    a stop; every column of times is a trip. A row of day notes (e.g. 'FER',
+    'FEST') gives the days of the week of the trips below it.
+
+    :param payload: content of the pdf
+    :param file_hash: sha256 hash of the pdf
+    :return: the timetable, None if no timetable can be extracted
+    """
+    pdfplumber = _pdfplumber()
+    if pdfplumber is None:
+        return None
+
+    tables = list()
+    days = list()
+    with pdfplumber.open(io.BytesIO(payload)) as pdf:
+        for page in pdf.pages:
+            for table in page.extract_tables():
+                rows = list()
+                table_days = None
+                for row in table:
+                    if not row:
+                        continue
+                    if not rows:
+                        row_days = [parse_days(cell) for cell in row[1:]]
+                        if any(d is not None for d in row_days):
+                            table_days = row_days
+                            continue
+                    if not row[0]:
+                        continue
+                    times = [parse_time(cell) for cell in row[1:]]
+                    if any(t is not None for t in times):
+                        rows.append((' '.join(row[0].split()), times))
+                if rows:
+                    tables.append(rows)
+                    days.append(table_days)
+
+    if not tables:
+        return None
+    return Timetable.from_rows(file_hash, tables, days)
@@ -0,0 +1,51 @@
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .pdf_extraction import extract_timetable
+
+# kinds of executor running the CPU bound stages of the scraper
+PROCESS = 'process'
+THREAD = 'thread'
+
+
+def default_workers():
+    """
+    :return: number of workers used when none is configured
+    """
+    return os.cpu_count() or 1
+
+
+def create_executor(kind=PROCESS, workers=None):
+    """
+    Build the executor hashing and parsing the timetables.
+    Processes keep the CPU bound work away from the event loop and the bot
+    threads (no GIL contention); threads avoid copying the pdfs between processes.
+    Processes are spawned rather than forked, since the gRPC channels of the
+    Firestore client are not fork-safe.
+    :param kind: PROCESS or THREAD
+    :param workers: number of workers, one per core if None
+    """
+    workers = workers or default_workers()
+    if kind == PROCESS:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    if kind == THREAD:
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scraper')
+    raise ValueError(f'Unknown executor kind: {kind}')
+
+
+def process_file(payload: bytes, extracted_hash, extract=True):
+    """
+    Hash a timetable pdf and extract its departures if the pdf changed since
+    the last extraction. Runs on a worker of the executor.
+    :param payload: content of the pdf
+    :param extracted_hash: hash of the pdf the stored timetable was extracted from
+    :param extract: whatever or not departures should be extracted
+    :return: tuple (file hash, Timetable or None)
+    """
+    file_hash = hashlib.sha256(payload).hexdigest()
+    timetable = None
+    if extract and file_hash != extracted_hash:
+        timetable = extract_timetable(payload, file_hash)
+    return file_hash, timetable
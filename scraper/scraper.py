@@ -1,29 +1,29 @@
 import asyncio
 import hashlib
 import logging
-import os
 import random
 from datetime import datetime
-from typing import List
+from typing import List, TYPE_CHECKING
 
-import aiohttp
-import requests
-from bs4 import BeautifulSoup
-
-from line import Line
+from config import config
+from line import Line, normalize_city
 from utils import chunkify
 from utils.bitly_utils import shorten
+from .history import LineHistory
+from .processing import create_executor, default_workers, process_file
+from utils.http_utils import get_session, get_aiohttp_session, TIMEOUT
+from utils.resilience import CircuitOpenError, RejectedError, bitly_breaker, grandabus_breaker
 
-BITLY_ACCESS_TOKEN_ENV = "BITLY_ACCESS_TOKEN"
+if TYPE_CHECKING:
+    # imported by utils.http_utils when the session is created
+    import aiohttp
 
 FIRESTORE_BATCH_MAXIMUM_SIZE = 500
 
-logger = logging.getLogger(__name__)
+# timetables are larger documents: keep their batches well below the 10 MiB request limit
+TIMETABLES_BATCH_SIZE = 50
 
-if BITLY_ACCESS_TOKEN_ENV not in os.environ:
-    raise ValueError(
-        "Environment variable '{}' required".format(BITLY_ACCESS_TOKEN_ENV))
-bitly_token = os.getenv(BITLY_ACCESS_TOKEN_ENV)
+logger = logging.getLogger(__name__)
 
 
 def get_soup_and_hash(url):
@@ -32,11 +32,16 @@ def get_soup_and_hash(url):
     :param url: url to be scraped
     :return: BeautifulSoup of the html response obtained
     """
-    response = requests.get(url)
-    if not response.status_code == 200:
-        raise Exception(f'Something went wrong while requesting {url}')
+    # imported here since it is only needed while scraping
+    from bs4 import BeautifulSoup
+
+    def fetch():
+        response = get_session().get(url, timeout=TIMEOUT)
+        if not response.status_code == 200:
+            raise IOError(f'Something went wrong while requesting {url}')
+        return response.text
 
-    text = response.text
+    text = grandabus_breaker.call(fetch)
     response_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
     return BeautifulSoup(text, "html.parser"), response_hash
 
@@ -50,19 +55,51 @@ class GrandaBusScraper:
     # url of the timetable page from GrandaBus website
     _URL = "http://grandabus.it/orari-per-localita/"
 
+    # range of seconds to wait between two Bit.ly requests
+    SHORTEN_DELAY = (1, 2)
+    # range of seconds to wait between two timetable downloads
+    DOWNLOAD_DELAY = (5, 10)
+
     def __init__(self, firestore_client,
-                 do_not_overwrite_if_unchanged=True):
+                 do_not_overwrite_if_unchanged=True,
+                 url=_URL,
+                 shorten_delay=SHORTEN_DELAY,
+                 download_delay=DOWNLOAD_DELAY,
+                 extract_timetables=True,
+                 executor=None,
+                 workers=None,
+                 keep_history=True):
         """
         Constructor
         Instantiate a new GrandaBusScraper
+
+        :param url: url of the timetable page
+        :param shorten_delay: range of seconds to wait between two Bit.ly requests
+        :param download_delay: range of seconds to wait between two timetable downloads
+        :param extract_timetables: whatever or not departures should be extracted from the pdfs
+        :param executor: executor hashing and parsing the pdfs, a new one is
+                         created for each session if None
+        :param workers: number of pdfs processed concurrently
+        :param keep_history: whatever or not the changes of the lines should be recorded
         """
         self.do_not_overwrite_if_unchanged = do_not_overwrite_if_unchanged
 
         self._firestore = firestore_client
+        self._url = url
+        self._shorten_delay = shorten_delay
+        self._download_delay = download_delay
+        self._extract_timetables = extract_timetables
+        self._executor = executor
+        self._workers = workers
+        self._history = LineHistory(firestore_client) if keep_history else None
 
         # callbacks
         self._on_line_deleted = None
         self._on_lines_file_changed = None
+        self._on_session_saved = None
+        self._on_lines_saved = None
+        # id of the running session, set when it starts
+        self.session = None
 
     @property
     def on_lines_deleted(self):
@@ -84,14 +121,37 @@ class GrandaBusScraper:
             raise ValueError("on_line_file_changed callback should not be None")
         self._on_lines_file_changed = callback
 
+    @property
+    def on_session_saved(self):
+        return self._on_session_saved
+
+    @on_session_saved.setter
+    def on_session_saved(self, callback):
+        if not callback:
+            raise ValueError("on_session_saved callback should not be None")
+        self._on_session_saved = callback
+
+    @property
+    def on_lines_saved(self):
+        return self._on_lines_saved
+
+    @on_lines_saved.setter
+    def on_lines_saved(self, callback):
+        if not callback:
+            raise ValueError("on_lines_saved callback should not be None")
+        self._on_lines_saved = callback
+
     async def run(self):
         """
         Scrape the timetables page
         """
         logger.info("Scraping started")
-        lines = list()
+        self.session = datetime.now().isoformat()
+        # lines and the cities they serve, by line code
+        lines = dict()
+        cities = dict()
 
-        soup, response_hash = get_soup_and_hash(self._URL)
+        soup, response_hash = get_soup_and_hash(self._url)
 
         if self.do_not_overwrite_if_unchanged:
             if response_hash == self._get_last_session_hash():
@@ -116,8 +176,7 @@ class GrandaBusScraper:
             line_code = td.get_text()
 
             # check if a line with the same code already exists
-            line = next(filter(lambda x: x.code == line_code, lines), None)
-            if line is None:
+            if line_code not in lines:
                 # if the line does not exists, create one
                 td = td.find_next_sibling("td")
                 line_name = td.get_text()
@@ -125,13 +184,20 @@ class GrandaBusScraper:
                 a = td.find_next_sibling("td").find("a")
                 url = a['href']
 
-                line = Line(line_code, line_name, url)
-                lines.append(line)
+                lines[line_code] = Line(line_code, line_name, url)
+                cities[line_code] = list()
+
+            cities[line_code].append(name)
 
-            line.cities.append(name)
+        for line in lines.values():
+            line.cities = tuple(cities[line.code])
 
-        await self._complete(lines)
-        self._set_last_session_hash(response_hash, datetime.now())
+        await self._complete(list(lines.values()))
+
+        date = datetime.now()
+        self._set_last_session_hash(response_hash, date)
+        if self.on_session_saved:
+            self.on_session_saved(date)
 
     async def _complete(self, lines: List[Line]):
         """
@@ -141,32 +207,46 @@ class GrandaBusScraper:
 
         :param lines: lines scraped
         """
-        await self._shorten_urls(lines)
-        await self._compute_file_hashes(lines)
+        unshortened = await self._shorten_urls(lines)
+        timetables = await self._compute_file_hashes(lines, self._get_timetable_hashes())
 
-        old_lines = self._get_all_lines()
+        old_lines = {line.code: line for line in self._get_all_lines()}
+
+        # a timetable that could not be downloaded keeps its last known hash,
+        # so that it is not reported as changed once it is available again
+        for line in lines:
+            old_line = old_lines.get(line.code)
+            if line.file_hash is None and line.url and old_line is not None:
+                line.file_hash = old_line.file_hash
 
         # delete lines that are currently inside the database
         # but not into the ones just scraped
-        should_delete = set(old_lines) - set(lines)  # set difference
+        should_delete = set(old_lines.values()) - set(lines)  # set difference
         should_delete_ids = list(map(lambda x: x.code, should_delete))
         self._delete_old_lines(should_delete_ids)
 
         should_notify_file_change = list()
         for line in lines:
-            try:
-                old_line = next(filter(lambda x: x.code == line.code, old_lines))
-                if line.file_hash is not None and not old_line.file_hash == line.file_hash:
-                    should_notify_file_change.append(old_line)  # old_line contains the list of users to be notified
-            except StopIteration:
-                pass
+            old_line = old_lines.get(line.code)
+            if old_line is not None and line.file_hash is not None and not old_line.file_hash == line.file_hash:
+                should_notify_file_change.append(old_line)  # old_line contains the list of users to be notified
 
-        # notify the outer world
+        # push the lines to the database
+        self._save(lines)
+        self._save_timetables(timetables)
+
+        # notify the outer world, once the changes are stored
         self.on_lines_deleted(should_delete)
         self.on_lines_file_changed(should_notify_file_change)
+        if self.on_lines_saved:
+            self.on_lines_saved(lines)
 
-        # push the lines to the database
-        self._save(lines)
+        # the history is recorded last: losing it must not lose the notifications
+        if self._history:
+            try:
+                self._history.record(old_lines, lines, datetime.now(), unshortened)
+            except Exception as e:
+                logger.error(f'Cannot record the history of the lines: {e}')
 
     def _get_last_session_hash(self):
         """
@@ -189,22 +269,71 @@ class GrandaBusScraper:
 
     def _save(self, lines):
         """
-        Save lines scraped from the website.
+        Save lines scraped from the website, and the lines serving each city
+        in the `cities` collection (one document per city, deleted when no
+        line serves the city anymore). Only the cities whose lines changed are written.
         :param lines: lines to be saved
         """
         lines_ref = self._firestore.collection(u'lines')
-        # split the lines in chunks and batch update them in the database
-        for chunk in chunkify(lines, FIRESTORE_BATCH_MAXIMUM_SIZE):
-            batch = self._firestore.batch()
-            for line in chunk:
-                batch.set(lines_ref.document(line.code), {
+        cities_ref = self._firestore.collection(u'cities')
+
+        cities = dict()
+        for line in lines:
+            for city in line.cities:
+                cities.setdefault(normalize_city(city), dict())[line.code] = {
                     u'code': line.code,
                     u'name': line.name,
                     u'timetable_url': line.url,
-                    u'cities': list(line.cities),
-                    u'file_hash': line.file_hash
-                }, merge=True)
-                logging.info(f'saving line with code {line.code}')
+                    u'file_hash': line.file_hash,
+                }
+        cities = {city: {u'lines': [city_lines[code] for code in sorted(city_lines)]}
+                  for city, city_lines in cities.items()}
+        stored_cities = {doc.id: doc.to_dict() for doc in cities_ref.stream()}
+        stale_cities = [city for city in stored_cities if city not in cities]
+
+        # (reference, data, merge) of every write, data is None for deletes
+        writes = [(lines_ref.document(line.code), {
+            u'code': line.code,
+            u'name': line.name,
+            u'timetable_url': line.url,
+            u'cities': list(line.cities),
+            u'file_hash': line.file_hash
+        }, True) for line in lines]
+        writes += [(cities_ref.document(city), data, False)
+                   for city, data in cities.items() if stored_cities.get(city) != data]
+        writes += [(cities_ref.document(city), None, False) for city in stale_cities]
+
+        # split the writes in chunks and batch them in the database
+        for chunk in chunkify(writes, FIRESTORE_BATCH_MAXIMUM_SIZE):
+            batch = self._firestore.batch()
+            for ref, data, merge in chunk:
+                if data is None:
+                    batch.delete(ref)
+                    logger.info(f'deleting city {ref.id}')
+                else:
+                    batch.set(ref, data, merge=merge)
+                    logger.debug(f'saving {ref.id}')
+            batch.commit()
+
+    def _get_timetable_hashes(self):
+        """
+        Read the hashes of the pdfs the stored timetables were extracted from.
+        :return: a dictionary of hashes, by line code
+        """
+        timetables_ref = self._firestore.collection(u'timetables')
+        return {doc.id: doc.to_dict().get('file_hash') for doc in timetables_ref.select([u'file_hash']).stream()}
+
+    def _save_timetables(self, timetables):
+        """
+        Save the timetables extracted in this session.
+        :param timetables: timetables, by line code
+        """
+        timetables_ref = self._firestore.collection(u'timetables')
+        for chunk in chunkify(list(timetables.items()), TIMETABLES_BATCH_SIZE):
+            batch = self._firestore.batch()
+            for code, timetable in chunk:
+                batch.set(timetables_ref.document(code), timetable.to_dict())
+                logger.info(f'saving timetable of line {code}: {timetable}')
             batch.commit()
 
     def _get_all_lines(self) -> List[Line]:
@@ -221,14 +350,16 @@ class GrandaBusScraper:
         :param should_delete: lines to be deleted
         """
         lines_ref = self._firestore.collection(u'lines')
+        timetables_ref = self._firestore.collection(u'timetables')
 
-        # split the should_delete into chunks of size 500
+        # split the should_delete into chunks of size 250 (two deletes per line)
         # and then batch delete them
-        for chunk in chunkify(should_delete, FIRESTORE_BATCH_MAXIMUM_SIZE):
+        for chunk in chunkify(should_delete, FIRESTORE_BATCH_MAXIMUM_SIZE // 2):
             batch = self._firestore.batch()
 
             for line in chunk:
                 batch.delete(lines_ref.document(line))
+                batch.delete(timetables_ref.document(line))
                 logger.info(f'deleting outdated line {line}.')
             batch.commit()
 
@@ -248,54 +379,114 @@ class GrandaBusScraper:
                and headers[3] == "linea" \
                and headers[4] == "url"
 
-    @staticmethod
-    async def _shorten_urls(lines: List[Line]):
+    async def _shorten_urls(self, lines: List[Line]):
         """
         Shorten timetables's URLs.
         Since shortening is not mandatory, if one process fails a log written and that url ignored.
+        While Bit.ly is unavailable the long urls are kept without trying.
         :param lines: lines to be processed
+        :return: set of the codes of the lines whose url was not shortened
         """
         # try to shorten the urls
-        async with aiohttp.ClientSession() as session:
-            for line in lines:
-                try:
-                    old_url = line.url
-                    line.url = await shorten(line.url, bitly_token, session) or line.url
-                    logger.info(f'Shortened url {old_url} -> {line.url}')
-                except Exception as e:
-                    logger.error(f'Cannot shorten {line.url}. Message: {e}')
-                await asyncio.sleep(random.randint(1, 2))
-
-    @staticmethod
-    async def _compute_file_hashes(lines: List[Line]):
+        bitly_token = config.bitly_access_token
+        session = get_aiohttp_session()
+        unshortened = set()
+        for line in lines:
+            try:
+                old_url = line.url
+                line.url = await bitly_breaker.call_async(shorten, line.url, bitly_token, session) or line.url
+                logger.info(f'Shortened url {old_url} -> {line.url}')
+            except CircuitOpenError:
+                # no request was made, no need to wait
+                unshortened.add(line.code)
+                continue
+            except Exception as e:
+                logger.error(f'Cannot shorten {line.url}. Message: {e!r}')
+            if line.url == old_url:
+                unshortened.add(line.code)
+            await asyncio.sleep(random.randint(*self._shorten_delay))
+        return unshortened
+
+    async def _compute_file_hashes(self, lines: List[Line], extracted_hashes=None):
         """
-        Download timetables and compute sha256 hashes
+        Download timetables, compute sha256 hashes and extract the departures
+        of the timetables changed since their last extraction.
+
+        Downloads are fed to the workers of the executor through a bounded
+        queue: the CPU bound work does not block the event loop, and at most
+        2 * workers pdfs are kept in memory.
+
         :param lines: lines to be processed
+        :param extracted_hashes: hashes of the stored timetables, by line code
+        :return: the timetables extracted, by line code
         """
-        async with aiohttp.ClientSession() as session:
-            for i, line in enumerate(lines):
+        extracted_hashes = extracted_hashes or dict()
+        timetables = dict()
+
+        workers = self._workers or config.scraper_workers or default_workers()
+        executor = self._executor or create_executor(config.scraper_executor, workers)
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=2 * workers)
+
+        async def download():
+            session = get_aiohttp_session()
+            try:
+                for i, line in enumerate(lines):
+                    try:
+                        payload = await grandabus_breaker.call_async(GrandaBusScraper._download_file, line, session)
+                        if payload is not None:
+                            await queue.put((i, line, payload))
+                    except CircuitOpenError:
+                        # grandabus.it is unavailable: the line keeps its last known hash, and the next
+                        # ones are tried at the usual pace until the circuit lets a trial call through
+                        logger.warning(f'grandabus.it is unavailable, skipping {i + 1}/{len(lines)} (line {line.code})')
+                    except Exception as e:
+                        logger.error(f'Error downloading {i + 1}/{len(lines)} (line {line.code}): {e!r}')
+                    await asyncio.sleep(random.randint(*self._download_delay))
+            finally:
+                for _ in range(workers):
+                    await queue.put(None)
+
+        async def process():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+
+                i, line, payload = item
                 try:
-                    line.file_hash = await GrandaBusScraper._compute_file_hash(line, session)
-                    logging.debug(f'Computed hash {i + 1}/{len(lines)} (line {line.code}): {line.file_hash}')
-                    await asyncio.sleep(random.randint(5, 10))
+                    line.file_hash, timetable = await loop.run_in_executor(
+                        executor, process_file, payload, extracted_hashes.get(line.code), self._extract_timetables)
+                    logger.debug(f'Computed hash {i + 1}/{len(lines)} (line {line.code}): {line.file_hash}')
+                    if timetable is not None:
+                        timetables[line.code] = timetable
                 except Exception as e:
-                    logging.error(f'Error computing hash {i}/{len(lines)}: {e}')
+                    logger.error(f'Error computing hash {i + 1}/{len(lines)} (line {line.code}): {e}')
+
+        try:
+            await asyncio.gather(download(), *(process() for _ in range(workers)))
+        finally:
+            if self._executor is None:
+                executor.shutdown()
+
+        return timetables
 
     @staticmethod
-    async def _compute_file_hash(line: Line, session: aiohttp.ClientSession):
+    async def _download_file(line: Line, session: 'aiohttp.ClientSession'):
         """
-        Compute the sha256 hash of the line's timetable pdf.
+        Download the line's timetable pdf.
         :param line: line to be processed
         :param session: aiohttp session
-        :return: the sha256 hash of the timetable
+        :return: the content of the timetable, None if the line has no timetable
         """
         if not line.url:
             return None
 
         async with session.get(line.url) as response:
+            if 400 <= response.status < 500:
+                # e.g. a missing pdf: grandabus.it itself is available
+                raise RejectedError(f'Cannot fetch {line.url}: {response.status}')
             if not response.status == 200:
-                raise IOError(f'Cannot fetch {line.url}')
+                raise IOError(f'Cannot fetch {line.url}: {response.status}')
 
-            payload = await response.read()
-            h = hashlib.sha256(payload)
-            return h.hexdigest()
+            return await response.read()
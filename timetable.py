@@ -0,0 +1,190 @@
+import re
+import sys
+from array import array
+from bisect import bisect_left
+
+# marks a trip not calling at a stop
+NO_STOP = 0xFFFF
+
+# bit masks of the days of the week a trip runs on, bit 0 is monday
+ALL_DAYS = 0x7F
+MONDAY_TO_FRIDAY = 0x1F
+MONDAY_TO_SATURDAY = 0x3F
+SATURDAY = 0x20
+SUNDAY = 0x40
+
+_TIME_RE = re.compile(r'^\s*(\d{1,2})[.:](\d{2})\s*$')
+
+# notes printed on the timetables above the trips (e.g. 'FER', 'SCOL', 'FEST')
+_DAYS = {
+    'FER': MONDAY_TO_SATURDAY,
+    'FERIALE': MONDAY_TO_SATURDAY,
+    'LUN-SAB': MONDAY_TO_SATURDAY,
+    'L-S': MONDAY_TO_SATURDAY,
+    'SCOL': MONDAY_TO_SATURDAY,
+    'SCOLASTICO': MONDAY_TO_SATURDAY,
+    'LUN-VEN': MONDAY_TO_FRIDAY,
+    'L-V': MONDAY_TO_FRIDAY,
+    'SAB': SATURDAY,
+    'SABATO': SATURDAY,
+    'FEST': SUNDAY,
+    'FESTIVO': SUNDAY,
+    'DOM': SUNDAY,
+    'DOMENICA': SUNDAY,
+    'GIORNALIERO': ALL_DAYS,
+}
+
+
+def parse_time(text):
+    """
+    :param text: time as printed on the timetables (e.g. '7.05' or '17:45')
+    :return: minutes after midnight, None if text is not a time
+    """
+    match = _TIME_RE.match(text or '')
+    if not match:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 30 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def parse_days(text):
+    """
+    :param text: days of service as printed on the timetables (e.g. 'FER' or 'Lun-Ven')
+    :return: bit mask of the days, None if text is not a known day note
+    """
+    return _DAYS.get(''.join((text or '').upper().split()).rstrip('.'))
+
+
+class Timetable:
+    """
+    This class models the timetable of a bus line in columnar form.
+
+    `times` is a stops x trips matrix stored row by row in an array of 16 bit
+    minute offsets from midnight (NO_STOP where the trip does not call at the
+    stop), `days` the bit mask of the days of the week each trip runs on. The
+    sorted departures of every stop are built on first use for each day of
+    the week, so next-departure queries are a binary search.
+
+    Holidays and school calendars are not known: a trip runs on every day of
+    its mask.
+    """
+
+    __slots__ = ('file_hash', 'stops', 'n_trips', 'times', 'days', '_departures')
+
+    def __init__(self, file_hash, stops, n_trips, times, days=None):
+        """Constructor
+
+        :param file_hash: sha256 hash of the pdf the timetable was extracted from
+        :param stops: names of the stops
+        :param n_trips: number of trips
+        :param times: array('H') of len(stops) * n_trips minute offsets
+        :param days: array('B') of n_trips day masks, None if every trip runs every day
+        """
+        self.file_hash = file_hash
+        self.stops = tuple(stops)
+        self.n_trips = n_trips
+        self.times = times
+        self.days = days if days is not None else array('B', [ALL_DAYS]) * n_trips
+        self._departures = dict()
+
+    @staticmethod
+    def from_rows(file_hash, rows, days=None):
+        """
+        Build a timetable from the rows of the tables printed in the pdf.
+        Rows of different tables are different trips; rows of the same stop are merged.
+        :param file_hash: hash of the pdf
+        :param rows: list of tables, each a list of (stop name, [minutes or None per trip])
+        :param days: list with the day masks (or None) of the trips of each table, None if unknown
+        """
+        stops = dict()
+        columns = list()
+        trip_days = array('B')
+        offset = 0
+        for n, table in enumerate(rows):
+            width = max((len(times) for _, times in table), default=0)
+            for stop, times in table:
+                column = columns[stops[stop]] if stop in stops else None
+                if column is None:
+                    stops[stop] = len(columns)
+                    column = dict()
+                    columns.append(column)
+                for trip, minute in enumerate(times):
+                    if minute is not None:
+                        column[offset + trip] = minute
+            table_days = days[n] if days else None
+            trip_days.extend((table_days[trip] if table_days and trip < len(table_days) else None) or ALL_DAYS
+                             for trip in range(width))
+            offset += width
+
+        times = array('H', [NO_STOP]) * (len(columns) * offset)
+        for i, column in enumerate(columns):
+            for trip, minute in column.items():
+                times[i * offset + trip] = minute
+        return Timetable(file_hash, stops.keys(), offset, times, trip_days)
+
+    def departures(self, stop_index, weekday=None):
+        """
+        :param stop_index: index of the stop
+        :param weekday: day of the week (0 is monday), None for the trips of every day
+        :return: sorted array of the departures from the stop
+        """
+        departures = self._departures.get(weekday)
+        if departures is None:
+            n = self.n_trips
+            mask = ALL_DAYS if weekday is None else 1 << weekday
+            departures = self._departures[weekday] = tuple(
+                array('H', sorted(t for t, days in zip(self.times[i * n:(i + 1) * n], self.days)
+                                  if t != NO_STOP and days & mask))
+                for i in range(len(self.stops)))
+        return departures[stop_index]
+
+    def next_departures(self, place, minute, weekday=None, count=3):
+        """
+        Find the next departures from the stops whose name contains `place`.
+        :param place: (part of) the stop name, case insensitive
+        :param minute: minutes after midnight
+        :param weekday: day of the week (0 is monday), None for the trips of every day
+        :param count: maximum number of departures per stop
+        :return: list of (stop name, [minutes])
+        """
+        place = place.upper()
+        result = list()
+        for i, stop in enumerate(self.stops):
+            if place not in stop.upper():
+                continue
+            departures = self.departures(i, weekday)
+            start = bisect_left(departures, minute)
+            if start < len(departures):
+                result.append((stop, departures[start:start + count].tolist()))
+        return result
+
+    @staticmethod
+    def from_dict(source: dict):
+        times = array('H')
+        times.frombytes(source['times'])
+        if sys.byteorder == 'big':
+            times.byteswap()
+        days = None
+        if source.get('days') is not None:
+            days = array('B')
+            days.frombytes(source['days'])
+        return Timetable(source['file_hash'], source['stops'], source['n_trips'], times, days)
+
+    def to_dict(self):
+        # times are stored little endian
+        times = self.times
+        if sys.byteorder == 'big':
+            times = array('H', times)
+            times.byteswap()
+        return {
+            u'file_hash': self.file_hash,
+            u'stops': list(self.stops),
+            u'n_trips': self.n_trips,
+            u'times': times.tobytes(),
+            u'days': self.days.tobytes(),
+        }
+
+    def __repr__(self):
+        return f"Timetable({self.file_hash}, {len(self.stops)} stops, {self.n_trips} trips)"
@@ -1,13 +1,18 @@
 import logging
+from typing import TYPE_CHECKING
 
-import aiohttp
+from .resilience import RejectedError
+
+if TYPE_CHECKING:
+    # aiohttp is imported by the scraper when it creates the session
+    import aiohttp
 
 logger = logging.getLogger(__name__)
 
 BITLY_ENDPOINT = 'https://api-ssl.bitly.com/v4/shorten'
 
 
-async def shorten(url: str, access_token: str, session: aiohttp.ClientSession):
+async def shorten(url: str, access_token: str, session: 'aiohttp.ClientSession'):
     """
     Shorten url using bit.ly service
     :param url: url to be shortened
@@ -28,5 +33,8 @@ async def shorten(url: str, access_token: str, session: aiohttp.ClientSession):
         if response.status in (200, 201):
             json = await response.json()
             return json['link']
+        elif 400 <= response.status < 500:
+            # e.g. an invalid url: Bit.ly itself is available
+            raise RejectedError(f'Cannot shorten {url}. Response from Bit.ly was {await response.text()}')
         else:
             raise IOError(f'Cannot shorten {url}. Response from Bit.ly was {await response.text()}')
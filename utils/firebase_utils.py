@@ -1,8 +1,8 @@
-import os
-
 import firebase_admin
 from firebase_admin import credentials
 
+from config import config
+
 
 def init_firebase():
     # noinspection PyProtectedMember
@@ -10,10 +10,7 @@ def init_firebase():
         # Firebase is already initialized, nothing left to do here
         return
 
-    credentials_file = os.getenv('GOOGLE_CREDENTIALS_FILE', None)
-    if not credentials_file:
-        raise ValueError("Missing GOOGLE_CREDENTIALS_FILE environment "
-                         "variable")
+    credentials_file = config.google_credentials_file
 
     try:
         cred = credentials.Certificate(credentials_file)
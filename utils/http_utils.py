@@ -0,0 +1,80 @@
+import threading
+
+# seconds allowed to establish a connection
+CONNECT_TIMEOUT = 5
+# seconds allowed to read a whole response
+READ_TIMEOUT = 30
+
+# (connect, read) timeout to be passed to every requests call
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# maximum number of pooled connections kept open towards the same host
+MAX_CONNECTIONS_PER_HOST = 10
+
+# seconds a resolved host name is cached by the aiohttp connector
+DNS_CACHE_TTL = 300
+
+_session_lock = threading.Lock()
+_session = None
+_aiohttp_session = None
+
+
+# HTTP clients are imported on first use, so that each process only loads the
+# one it needs (requests for the bot, aiohttp for the scraper).
+
+def get_session():
+    """
+    Get the process-wide keep-alive requests.Session.
+    Calls made through it should pass `timeout=TIMEOUT`.
+    :return: the shared session
+    """
+    global _session
+
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS_PER_HOST,
+                                      pool_maxsize=MAX_CONNECTIONS_PER_HOST)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+
+    return _session
+
+
+def get_aiohttp_session():
+    """
+    Get the process-wide aiohttp.ClientSession. It must be called from inside
+    the event loop the session will be used on.
+    :return: the shared session
+    """
+    global _aiohttp_session
+
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit_per_host=MAX_CONNECTIONS_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+        timeout = aiohttp.ClientTimeout(total=READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        _aiohttp_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    return _aiohttp_session
+
+
+async def close_sessions():
+    """
+    Close the shared sessions. They are created again on the next use.
+    """
+    global _session, _aiohttp_session
+
+    if _aiohttp_session is not None:
+        await _aiohttp_session.close()
+        _aiohttp_session = None
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
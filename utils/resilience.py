@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import threading
+import time
+
+from .http_utils import READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# states of a circuit breaker
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitOpenError(IOError):
+    """
+    Raised instead of calling a dependency whose circuit is open.
+    """
+
+
+class RejectedError(IOError):
+    """
+    Raised by a call the dependency answered with a client error (e.g. HTTP
+    4xx for a missing pdf): the dependency is available, so the breaker does
+    not count it as a failure.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fail fast on a dependency that keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    raise CircuitOpenError without reaching the dependency. After
+    `reset_timeout` seconds a single trial call is let through (half-open):
+    its success closes the circuit, its failure opens it again. Only
+    exceptions other than RejectedError are failures.
+
+    :param name: name of the dependency, used in the logs
+    :param failure_threshold: consecutive failures opening the circuit
+    :param reset_timeout: seconds before a trial call is allowed
+    :param timeout: seconds allowed to each call made through `call_async`;
+                    synchronous calls must bound their own latency
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        Reserve a call to the dependency.
+        :return: true if the call can be made
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+                # let a single trial call through
+                self._state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f'Circuit {self.name} closed')
+            self._state = CLOSED
+            self._failures = 0
+
+    def release(self):
+        """
+        Give back a reserved call that neither succeeded nor failed (e.g. it was
+        cancelled): a trial call is let through again.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = OPEN
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning(f'Circuit {self.name} opened after {self._failures} failures')
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func through the breaker.
+        :raise CircuitOpenError: if the circuit is open
+        """
+        if not self.allow():
+            raise CircuitOpenError(f'{self.name} is unavailable')
+        try:
+            result = func(*args, **kwargs)
+        except RejectedError:
+            self.record_success()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) through the breaker, within `timeout` seconds.
+        :raise CircuitOpenError: if the circuit is open
+        :raise asyncio.TimeoutError: if the call took longer than `timeout`
+        """
+        if not self.allow():
+            raise CircuitOpenError(f'{self.name} is unavailable')
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), self.timeout)
+        except RejectedError:
+            self.record_success()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+
+# breakers of the third party services, shared by the whole process
+locationiq_breaker = CircuitBreaker('locationiq', failure_threshold=3, reset_timeout=60)
+bitly_breaker = CircuitBreaker('bitly', failure_threshold=3, reset_timeout=5 * 60, timeout=5)
+grandabus_breaker = CircuitBreaker('grandabus.it', failure_threshold=5, reset_timeout=60, timeout=READ_TIMEOUT)